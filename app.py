@@ -1,16 +1,185 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import joblib
-import pandas as pd
+import os
+import sys
+import json
+import hmac
+import threading
+import time
 import numpy as np
 
+from at_risk import Ranking, TopKSelector
+from cohort import CohortAggregator, parse_breakdowns
+from metrics import MetricsRegistry, Stopwatch
+from model_artifact import ARTIFACT_PATH, ENCODERS_PATH, MODEL_PATH, load_model
+from model_registry import ModelLoadError, ModelRegistry, UnknownModel, artifact_loader
+from model_reloader import ModelReloader, ServingModel
+from prediction_cache import PredictionCache
+from scoring_session import ScoringSession, SessionStore
+from similar_students import ReferenceSet, load_reference
+from record_stream import (InvalidRecord, detect_format, iter_chunks, iter_column_chunks, iter_lines,
+                           iter_records)
+from roster_store import RosterNotFound, RosterStore
+from request_profiler import CPROFILE, ProfilerBusy, RequestProfiler, parse_mode
+from startup_profile import StartupProfile, format_report, import_times
+from what_if import sweep_grid
+import counterfactual
+import partial_dependence
+
 app = Flask(__name__)
 CORS(app)
 
-# Load the trained model and encoders
-model = joblib.load('student_performance_model.pkl')
-label_encoders = joblib.load('label_encoders.pkl')
+# Load the trained model and encoders. The memory-mapped artifact written by
+# training (student_performance_model.spm) is preferred; without it the
+# pickled model is loaded and compiled into a flat-array engine.
+# Unseen or missing categories fall back to the most frequent training value.
+# Heavy modules (joblib, sklearn, pandas) are only imported on the pickle path.
+startup = StartupProfile()
+with startup.phase('load model'):
+    initial_model = ServingModel(*load_model())
+
+# LRU cache of predictions keyed on the model version and the encoded
+# feature vector, shared by every model (0 disables)
+cache = PredictionCache(capacity=int(os.environ.get('PREDICTION_CACHE_SIZE', '10000')))
+
+# Hot reload: each request reads ``reloader.current`` once and uses that
+# bundle throughout; a reload swaps in a new one only after it has been
+# loaded, warmed and benchmarked. Retrained files are picked up by polling
+# every MODEL_WATCH_INTERVAL seconds (0 disables) or via /admin/reload.
+reloader = ModelReloader(
+    load_model,
+    max_slowdown=float(os.environ.get('RELOAD_MAX_SLOWDOWN', '1.5')),
+    on_swap=lambda new, old: on_model_swap(new, old),
+    initial=initial_model
+)
+if float(os.environ.get('MODEL_WATCH_INTERVAL', '0')) > 0:
+    reloader.watch([ARTIFACT_PATH, MODEL_PATH, ENCODERS_PATH],
+                   interval=float(os.environ['MODEL_WATCH_INTERVAL']))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+
+def has_admin_token():
+    """Whether the request's ``X-Admin-Token`` header matches ADMIN_TOKEN (never while unset)"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+# Reference students for /similar_students, indexed by forest proximity
+# under the default model. Nothing is read at import: the index is built in
+# the background on first use and again after each reload, by one worker
+# that always builds for the latest model. Queries keep using the previous
+# index meanwhile, and get 503 until the first is ready.
+REFERENCE_DATA_PATH = os.environ.get('REFERENCE_DATA_PATH', 'student_data.csv')
+reference_set = None
+reference_requested = False
+reference_pending = None
+reference_worker = None
+reference_lock = threading.Lock()
+
+
+def current_reference_set():
+    """The similarity index, starting its first build on first use; None until built"""
+    global reference_requested
+    with reference_lock:
+        first, reference_requested = not reference_requested, True
+    if first and os.path.exists(REFERENCE_DATA_PATH):
+        rebuild_reference_set(reloader.current)
+    return reference_set
+
+
+def rebuild_reference_set(model):
+    """Queue an index build for ``model``, replacing any build still waiting"""
+    global reference_pending, reference_worker
+    with reference_lock:
+        reference_pending = model
+        if reference_worker is None:
+            reference_worker = threading.Thread(target=reference_set_worker,
+                                                name='similarity-index', daemon=True)
+            reference_worker.start()
+
+
+def reference_set_worker():
+    global reference_set, reference_pending, reference_worker
+    while True:
+        with reference_lock:
+            model, reference_pending = reference_pending, None
+            if model is None:
+                reference_worker = None
+                return
+        references = ReferenceSet(model, REFERENCE_DATA_PATH)
+        with reference_lock:
+            # A build for a model swapped out meanwhile is dropped; the
+            # newer model's build is already queued
+            if reference_pending is None:
+                reference_set = references
+
+
+# Rosters persisted under ROSTER_DIR with their materialized scores. Reads
+# never touch the model; a reload re-scores them in the background. The store
+# is opened on first use, not at import, and re-scores rosters last scored by
+# another model version when it is opened.
+rosters = None
+rosters_lock = threading.Lock()
+
+
+def roster_store():
+    global rosters
+    with rosters_lock:
+        if rosters is None:
+            store = RosterStore(os.environ.get('ROSTER_DIR', 'rosters'))
+            if store.ids():
+                store.rescore_all(reloader.current)
+            rosters = store
+        return rosters
+
+# Partial-dependence curves over the reference students, computed once per
+# model version and served from here
+partial_dependence_reports = {}
+partial_dependence_lock = threading.Lock()
+
+
+def partial_dependence_report(model):
+    with partial_dependence_lock:
+        report = partial_dependence_reports.get(model.model_id)
+        if report is None or report['model_version'] != model.version:
+            _, _, matrix = load_reference(REFERENCE_DATA_PATH, model.encoder)
+            report = partial_dependence.compute(model, matrix)
+            partial_dependence_reports[model.model_id] = report
+        return report
+
+
+def on_model_swap(new, old):
+    cache.invalidate(old.version)
+    if reference_requested and os.path.exists(REFERENCE_DATA_PATH):
+        rebuild_reference_set(new)
+    if rosters is not None:
+        rosters.rescore_all(new)
+    if os.path.exists(REFERENCE_DATA_PATH):
+        threading.Thread(target=partial_dependence_report, args=(new,),
+                         name='partial-dependence', daemon=True).start()
+
+# Opt-in micro-batching of concurrent /predict calls
+batcher = None
+if os.environ.get('MICROBATCH_ENABLED', '0') == '1':
+    from micro_batcher import MicroBatcher
+
+    batcher = MicroBatcher(
+        lambda matrix: reloader.current.engine.explain(matrix),
+        window_ms=float(os.environ.get('MICROBATCH_WINDOW_MS', '2')),
+        max_batch_size=int(os.environ.get('MICROBATCH_MAX_ROWS', '64'))
+    )
+
+# Opt-in cascade: a distilled tree answers the rows it is confident about
+# and only the rest are scored by the forest it was distilled from
+cascade = None
+if os.environ.get('CASCADE_ENABLED', '0') == '1':
+    from cascade import CASCADE_PATH, Cascade
+
+    cascade = Cascade.load(
+        os.environ.get('CASCADE_PATH', CASCADE_PATH),
+        threshold=float(os.environ['CASCADE_THRESHOLD']) if os.environ.get('CASCADE_THRESHOLD') else None
+    )
 
 @app.route('/')
 def home():
@@ -20,51 +189,347 @@ def home():
         'version': '1.0'
     })
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    try:
-        # Get JSON data from request
-        data = request.get_json()
+# Request metrics, recorded per thread and exposed at /metrics
+metrics = MetricsRegistry(prefix='spp_')
+
+# Per-district models, selected with the X-Model-ID header or ?model=, are
+# loaded from MODEL_DIR/<id>.spm on first use. The least recently used are
+# evicted while their forests exceed MODEL_MEMORY_BUDGET_MB. Requests
+# without a model ID use the default model above.
+DEFAULT_MODEL_ID = 'default'
+registry = ModelRegistry(
+    artifact_loader(os.environ.get('MODEL_DIR', 'models')),
+    memory_budget=float(os.environ.get('MODEL_MEMORY_BUDGET_MB', '256')) * 1024 * 1024,
+    metrics=metrics
+)
+PREDICTION_ENDPOINTS = ('predict', 'predict_batch', 'predict_stream', 'what_if', 'counterfactual',
+                        'sessions', 'similar_students', 'cohort_analytics', 'at_risk', 'rosters',
+                        'partial_dependence')
+PREDICTION_STAGES = ('parse', 'encode', 'inference', 'explanation', 'serialize')
+request_counters = {endpoint: metrics.counter('requests_total', 'Prediction requests received',
+                                              endpoint=endpoint)
+                    for endpoint in PREDICTION_ENDPOINTS}
+error_counters = {endpoint: metrics.counter('request_errors_total', 'Prediction requests that failed',
+                                            endpoint=endpoint)
+                  for endpoint in PREDICTION_ENDPOINTS}
+stage_histograms = {endpoint: {stage: metrics.histogram('stage_latency_seconds',
+                                                        'Time spent in each request stage',
+                                                        endpoint=endpoint, stage=stage)
+                               for stage in PREDICTION_STAGES}
+                    for endpoint in ('predict', 'predict_batch')}
+early_exit_rows = metrics.counter('early_exit_rows_total', 'Rows scored in early-exit mode')
+early_exit_trees = metrics.counter('early_exit_trees_evaluated_total',
+                                   'Trees evaluated for rows scored in early-exit mode')
+request_latency = {served_by: metrics.histogram('request_latency_seconds',
+                                                'End-to-end /predict latency by what answered it',
+                                                endpoint='predict', served_by=served_by)
+                   for served_by in ('cache', 'distilled', 'forest')}
+
+# Scoring sessions for forms that change one field at a time: each delta
+# re-traces only the trees whose decision paths test a changed field
+sessions = SessionStore(
+    capacity=int(os.environ.get('SESSION_CAPACITY', '2000')),
+    ttl=float(os.environ.get('SESSION_TTL_SECONDS', '1800'))
+)
+
+# Finished /at_risk rankings, paged through with cursors until they expire
+rankings = SessionStore(
+    capacity=int(os.environ.get('RANKING_CAPACITY', '100')),
+    ttl=float(os.environ.get('RANKING_TTL_SECONDS', '3600'))
+)
+
+# Opt-in per-request profiling of /predict for clients sending ADMIN_TOKEN or
+# listed in PROFILE_TRUSTED_CLIENTS (none by default: behind a reverse proxy
+# every client appears local), plus optional sampling to a log file
+PROFILE_TRUSTED_CLIENTS = os.environ.get('PROFILE_TRUSTED_CLIENTS', '')
+profiler = RequestProfiler(
+    trusted_clients=[addr.strip() for addr in PROFILE_TRUSTED_CLIENTS.split(',') if addr.strip()],
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    log_path=os.environ.get('PROFILE_LOG_PATH', 'profiles.log')
+)
+
+# Features listed in each student's top_factors
+TOP_FACTORS = 5
+
+# Largest number of records accepted by /predict_batch in one request
+MAX_BATCH_SIZE = 50000
+
+# Rows scored per model call by /predict_stream
+STREAM_CHUNK_SIZE = 1000
+MAX_STREAM_CHUNK_SIZE = 10000
+
+# Largest grid scored by /what_if in one request
+MAX_WHAT_IF_POINTS = 100000
+
+# Limits of /counterfactual searches
+MAX_COUNTERFACTUAL_CHANGES = 4
+MAX_COUNTERFACTUAL_RESULTS = 10
+MAX_COUNTERFACTUAL_BUDGET_MS = 2000
+
+# Most neighbours returned by /similar_students
+MAX_SIMILAR_STUDENTS = 100
+
+# Rows scored per model call by /cohort_analytics, and its limits
+COHORT_CHUNK_SIZE = 10000
+MAX_COHORT_BINS = 100
+MAX_COHORT_GROUPS = 1000
+
+# Limits of /at_risk rankings
+MAX_AT_RISK_K = 10000
+AT_RISK_PAGE_SIZE = 50
+MAX_AT_RISK_PAGE_SIZE = 1000
+
+# Valid values of every feature, served to the frontend and swept by /what_if
+FEATURE_INFO = {
+    'categorical_features': {
+        'sex': ['M', 'F'],
+        'address': ['U', 'R'],  # Urban, Rural
+        'famsize': ['LE3', 'GT3'],  # <=3, >3
+        'Pstatus': ['T', 'A'],  # Together, Apart
+        'schoolsup': ['yes', 'no'],
+        'famsup': ['yes', 'no'],
+        'paid': ['yes', 'no'],
+        'activities': ['yes', 'no'],
+        'internet': ['yes', 'no'],
+        'romantic': ['yes', 'no']
+    },
+    'numerical_features': {
+        'age': {'min': 15, 'max': 19, 'description': 'Student age'},
+        'Medu': {'min': 0, 'max': 4, 'description': 'Mother education level'},
+        'Fedu': {'min': 0, 'max': 4, 'description': 'Father education level'},
+        'studytime': {'min': 1, 'max': 4, 'description': 'Weekly study time'},
+        'failures': {'min': 0, 'max': 3, 'description': 'Number of past class failures'},
+        'famrel': {'min': 1, 'max': 5, 'description': 'Quality of family relationships'},
+        'freetime': {'min': 1, 'max': 5, 'description': 'Free time after school'},
+        'goout': {'min': 1, 'max': 5, 'description': 'Going out with friends'},
+        'health': {'min': 1, 'max': 5, 'description': 'Current health status'},
+        'absences': {'min': 0, 'max': 20, 'description': 'Number of school absences'}
+    }
+}
+
+
+def resolve_model():
+    """The ServingModel requested by the current request"""
+    return model_for(request.headers.get('X-Model-ID') or request.args.get('model'))
+
+
+def model_for(model_id):
+    if not model_id or model_id == DEFAULT_MODEL_ID:
+        return reloader.current
+    return registry.get(model_id)
+
+
+def model_error(endpoint, error):
+    """404 for an unknown model, 500 for one whose artifact failed to load"""
+    error_counters[endpoint].inc()
+    code = 404 if isinstance(error, UnknownModel) else 500
+    return jsonify({'error': str(error), 'status': 'error'}), code
+
+
+def early_exit_mode(explain=False):
+    """None for exact inference, else ``(delta,)`` for early-exit labels.
+
+    ``?mode=early_exit`` stops once the remaining trees cannot change the
+    label; adding ``&confidence=0.99`` also stops once the vote is decided
+    with that confidence (``delta`` = 1 - confidence). Early-exit results
+    carry no factors, so it is rejected when ``explain`` was requested.
+    """
+    mode = request.args.get('mode', 'exact')
+    if mode == 'exact':
+        return None
+    if mode != 'early_exit':
+        raise ValueError(f"Unknown mode '{mode}': expected 'exact' or 'early_exit'")
+    if explain:
+        raise ValueError('explain cannot be combined with mode=early_exit, which returns labels')
+    confidence = request.args.get('confidence')
+    if confidence is None:
+        return (None,)
+    confidence = float(confidence)
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be between 0 and 1')
+    return (1.0 - confidence,)
+
+
+def score_early_exit(model, matrix, delta):
+    """Early-exit labels and trees evaluated per row, recorded in the metrics"""
+    started = time.perf_counter()
+    labels, evaluated = model.engine.predict_early_exit(matrix, delta=delta)
+    registry.observe_latency(model.model_id, time.perf_counter() - started)
+    early_exit_rows.inc(len(evaluated))
+    early_exit_trees.inc(int(evaluated.sum()))
+    return labels, evaluated
+
+
+def early_exit_result(prediction, trees_evaluated, model):
+    return {
+        'prediction': int(prediction),
+        'prediction_text': 'Pass' if prediction == 1 else 'Fail',
+        'trees_evaluated': int(trees_evaluated),
+        'n_trees': model.engine.n_trees,
+        'status': 'success'
+    }
+
+
+def cascade_for(model):
+    """The cascade fronting ``model``, or None"""
+    if cascade is not None and cascade.teacher_version == model.version:
+        return cascade
+    return None
+
 
-        # Create DataFrame from input data
-        input_df = pd.DataFrame([data])
+def run_model(model, matrix, explain):
+    """Score a feature matrix, through the cascade when one fronts ``model``.
 
-        # Encode categorical variables
-        categorical_columns = ['sex', 'address', 'famsize', 'Pstatus', 'schoolsup', 
-                              'famsup', 'paid', 'activities', 'internet', 'romantic']
+    Returns (labels, probas, contributions, distilled): ``contributions`` is
+    None unless ``explain``, and ``distilled`` marks the rows answered by the
+    cascade's distilled tree (None without a cascade).
+    """
+    started = time.perf_counter()
+    front = cascade_for(model)
+    distilled = None
+    if front is not None:
+        distilled, labels, probas, contributions = front.explain(matrix)
+        escalated = ~distilled
+        if escalated.any():
+            outputs = (model.engine.explain if explain else model.engine.predict)(matrix[escalated])
+            labels[escalated] = outputs[0]
+            probas[escalated] = outputs[1]
+            if explain:
+                contributions[escalated] = outputs[2]
+    elif explain:
+        labels, probas, contributions = model.engine.explain(matrix)
+    else:
+        labels, probas = model.engine.predict(matrix)
+    registry.observe_latency(model.model_id, time.perf_counter() - started)
+    return labels, probas, contributions if explain else None, distilled
 
-        for col in categorical_columns:
-            if col in input_df.columns:
-                # Handle unseen categories by using the most frequent category
-                try:
-                    input_df[col] = label_encoders[col].transform(input_df[col])
-                except ValueError:
-                    # If unseen category, use the most frequent encoded value
-                    input_df[col] = 0  # Default encoding
 
-        # Ensure all required columns are present
-        required_columns = ['age', 'sex', 'address', 'famsize', 'Pstatus', 'Medu', 'Fedu',
-                           'studytime', 'failures', 'schoolsup', 'famsup', 'paid', 'activities',
-                           'internet', 'romantic', 'famrel', 'freetime', 'goout', 'health', 'absences']
+def average_trees(results):
+    evaluated = [result['trees_evaluated'] for result in results if 'trees_evaluated' in result]
+    return sum(evaluated) / len(evaluated) if evaluated else 0.0
 
-        for col in required_columns:
-            if col not in input_df.columns:
-                input_df[col] = 0  # Default value
 
-        # Reorder columns to match training data
-        input_df = input_df[required_columns]
+def top_factors(model, contributions, n=TOP_FACTORS):
+    """Features that moved each student's pass probability the most.
 
-        # Make prediction
-        prediction = model.predict(input_df)[0]
-        prediction_proba = model.predict_proba(input_df)[0]
+    ``contributions`` is the (rows, features, classes) output of
+    ``engine.explain``; returns one list of factors per row, largest
+    absolute contribution first.
+    """
+    towards_pass = np.asarray(contributions)[..., 1].reshape(-1, len(model.encoder.columns))
+    order = np.argsort(-np.abs(towards_pass), axis=1, kind='stable')[:, :n]
+    values = np.take_along_axis(towards_pass, order, axis=1)
+    columns = model.encoder.columns
+    return [[{'feature': columns[i], 'contribution': value, 'importance': abs(value)}
+             for i, value in zip(row_order, row_values)]
+            for row_order, row_values in zip(order.tolist(), values.tolist())]
 
-        # Get feature importance for explanation
-        feature_importance = model.feature_importances_
-        feature_names = required_columns
 
-        # Create explanation
-        top_features = sorted(zip(feature_names, feature_importance), 
-                             key=lambda x: x[1], reverse=True)[:5]
+def score_records(model, records, start=0, stopwatch=None, explain=False, early_exit=None):
+    """Score a list of raw records with one vectorized model call.
+
+    Returns one result dict per record, in input order, and the number of
+    records that could not be encoded. ``start`` offsets the reported index.
+    With ``explain`` every result also lists the student's top factors.
+    With ``early_exit`` (see early_exit_mode) results carry labels and the
+    number of trees evaluated instead of probabilities.
+    """
+    matrix, positions, errors = model.encoder.encode_batch(records)
+    if stopwatch is not None:
+        stopwatch.lap('encode')
+
+    results = [None] * len(records)
+    if positions and early_exit is not None:
+        labels, evaluated = score_early_exit(model, matrix, *early_exit)
+        if stopwatch is not None:
+            stopwatch.lap('inference')
+        for pos, prediction, trees in zip(positions, labels.tolist(), evaluated.tolist()):
+            results[pos] = dict(early_exit_result(prediction, trees, model), index=start + pos)
+    elif positions:
+        predictions, probas, contributions, distilled = run_model(model, matrix, explain)
+        if stopwatch is not None:
+            stopwatch.lap('inference')
+        factors = top_factors(model, contributions) if explain else None
+        if stopwatch is not None:
+            stopwatch.lap('explanation')
+        for i, (pos, prediction, proba) in enumerate(zip(positions, predictions.tolist(),
+                                                         probas.tolist())):
+            results[pos] = {
+                'index': start + pos,
+                'prediction': int(prediction),
+                'prediction_text': 'Pass' if prediction == 1 else 'Fail',
+                'probability': {
+                    'fail': proba[0],
+                    'pass': proba[1]
+                },
+                'confidence': max(proba),
+                'status': 'success'
+            }
+            if explain:
+                results[pos]['top_factors'] = factors[i]
+            if distilled is not None:
+                results[pos]['served_by'] = 'distilled' if distilled[i] else 'forest'
+    for pos, message in errors.items():
+        if isinstance(records[pos], InvalidRecord):
+            message = records[pos].message
+        results[pos] = {'index': start + pos, 'error': message, 'status': 'error'}
+    return results, len(errors)
+
+
+def predict_one(model, stopwatch):
+    """Score the JSON student in the current request with ``model``"""
+    try:
+        # Get JSON data from request
+        data = request.get_json()
+        stopwatch.lap('parse')
+
+        early_exit = early_exit_mode()
+
+        # Encode straight into a feature row using the precomputed lookup tables
+        row = model.encoder.encode(data)
+        stopwatch.lap('encode')
+
+        if early_exit is not None:
+            labels, evaluated = score_early_exit(model, row, *early_exit)
+            stopwatch.lap('inference')
+            result = dict(early_exit_result(labels[0], evaluated[0], model),
+                          model_id=model.model_id, model_version=model.version)
+            response = jsonify(result)
+            stopwatch.lap('serialize')
+            return response
+
+        # Make prediction; label, probabilities and the student's feature
+        # contributions come from one traversal. Cached entries hold the
+        # formatted top factors, so a hit skips both stages.
+        cache_key = cache.key(row, model.version)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            prediction, prediction_proba, factors, served_by = cached
+            stopwatch.lap('inference')
+        else:
+            front = cascade_for(model)
+            distilled = None
+            if front is not None:
+                distilled, labels, probas, contributions = front.explain(row)
+            if distilled is not None and distilled[0]:
+                served_by = 'distilled'
+                prediction, prediction_proba = labels[0], probas[0]
+            else:
+                served_by = 'forest'
+                started = time.perf_counter()
+                if batcher is not None:
+                    prediction, prediction_proba, contributions = batcher.predict(
+                        row, predict_fn=model.engine.explain)
+                else:
+                    predictions, probas, contributions = model.engine.explain(row)
+                    prediction = predictions[0]
+                    prediction_proba = probas[0]
+                registry.observe_latency(model.model_id, time.perf_counter() - started)
+            stopwatch.lap('inference')
+            factors = top_factors(model, contributions)[0]
+            cache.put(cache_key, (prediction, prediction_proba.copy(), factors, served_by))
+        startup.mark('first prediction')
+        stopwatch.lap('explanation')
 
         result = {
             'prediction': int(prediction),
@@ -74,52 +539,816 @@ def predict():
                 'pass': float(prediction_proba[1])
             },
             'confidence': float(max(prediction_proba)),
-            'top_factors': [{'feature': feat, 'importance': float(imp)} 
-                           for feat, imp in top_features],
+            'top_factors': factors,
+            'model_id': model.model_id,
+            'model_version': model.version,
             'status': 'success'
         }
+        if cascade is not None:
+            result['served_by'] = served_by
 
-        return jsonify(result)
+        response = jsonify(result)
+        stopwatch.lap('serialize')
+        request_latency['cache' if cached is not None else served_by].observe(
+            stopwatch.elapsed_ms() / 1000.0)
+        return response
+
+    except Exception as e:
+        error_counters['predict'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    request_counters['predict'].inc()
+    try:
+        profile_mode = parse_mode(request.headers.get('X-Profile') or request.args.get('profile'))
+    except ValueError as e:
+        error_counters['predict'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    if profile_mode is not None and not (has_admin_token()
+                                         or profiler.is_trusted(request.remote_addr)):
+        error_counters['predict'].inc()
+        return jsonify({'error': 'Profiling is only available to trusted clients',
+                        'status': 'error'}), 403
+
+    sampled = profile_mode is None and profiler.should_sample()
+    profiled = profile_mode is not None or sampled
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('predict', e)
+    stopwatch = Stopwatch(stage_histograms['predict'], record=profiled)
+    try:
+        with profiler.capture(enabled=sampled or profile_mode == CPROFILE,
+                              required=profile_mode == CPROFILE) as capture:
+            response = app.make_response(predict_one(model, stopwatch))
+    except ProfilerBusy as e:
+        error_counters['predict'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 409
+    if not profiled or capture.skipped:
+        return response
+
+    report = {'stages_ms': stopwatch.laps, 'total_ms': stopwatch.elapsed_ms()}
+    if capture.summary is not None:
+        report['cprofile'] = capture.summary
+    if sampled:
+        profiler.log(dict(report, path=request.path, status=response.status_code,
+                          model_version=model.version, timestamp=time.time()))
+        return response
+    result = response.get_json()
+    result['profile'] = report
+    response.set_data(app.json.dumps(result))
+    return response
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """Score a list of student records with a single model call"""
+    request_counters['predict_batch'].inc()
+    stopwatch = Stopwatch(stage_histograms['predict_batch'])
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('predict_batch', e)
+    try:
+        data = request.get_json()
+        records = data.get('students') if isinstance(data, dict) else data
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON list of students or {'students': [...]}")
+        if len(records) > MAX_BATCH_SIZE:
+            raise ValueError(f'Batch too large: at most {MAX_BATCH_SIZE} students per request')
+        explain = request.args.get('explain', '0').lower() in ('1', 'true', 'yes')
+        early_exit = early_exit_mode(explain)
+        stopwatch.lap('parse')
+
+        results, errors = score_records(model, records, stopwatch=stopwatch, explain=explain,
+                                        early_exit=early_exit)
+
+        body = {
+            'results': results,
+            'count': len(results),
+            'errors': errors,
+            'model_id': model.model_id,
+            'model_version': model.version,
+            'status': 'success'
+        }
+        if early_exit is not None:
+            body['avg_trees_evaluated'] = average_trees(results)
+        response = jsonify(body)
+        stopwatch.lap('serialize')
+        return response
 
     except Exception as e:
+        error_counters['predict_batch'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+@app.route('/predict_stream', methods=['POST'])
+def predict_stream():
+    """Score an NDJSON or CSV upload in fixed-size chunks, streaming NDJSON back"""
+    request_counters['predict_stream'].inc()
+    try:
+        fmt = detect_format(request.content_type, request.args.get('format'))
+        chunk_size = int(request.args.get('chunk_size', STREAM_CHUNK_SIZE))
+        explain = request.args.get('explain', '0').lower() in ('1', 'true', 'yes')
+        early_exit = early_exit_mode(explain)
+        if not 1 <= chunk_size <= MAX_STREAM_CHUNK_SIZE:
+            raise ValueError(f'chunk_size must be between 1 and {MAX_STREAM_CHUNK_SIZE}')
+    except ValueError as e:
+        error_counters['predict_stream'].inc()
         return jsonify({
             'error': str(e),
             'status': 'error'
         }), 400
 
+    # The whole stream is scored by the model current when it started
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('predict_stream', e)
+
+    def generate():
+        count = 0
+        errors = 0
+        trees = 0
+        try:
+            # The body is consumed line by line, never loaded as a whole
+            records = iter_records(iter_lines(request.stream), fmt)
+            for chunk in iter_chunks(records, chunk_size):
+                results, chunk_errors = score_records(model, chunk, start=count, explain=explain,
+                                                      early_exit=early_exit)
+                count += len(chunk)
+                errors += chunk_errors
+                if early_exit is not None:
+                    trees += sum(result.get('trees_evaluated', 0) for result in results)
+                yield ''.join(json.dumps(result) + '\n' for result in results)
+        except Exception as e:
+            error_counters['predict_stream'].inc()
+            yield json.dumps({'error': str(e), 'count': count, 'status': 'error'}) + '\n'
+            return
+        summary = {'count': count, 'errors': errors, 'model_id': model.model_id,
+                   'model_version': model.version, 'status': 'done'}
+        if early_exit is not None:
+            summary['avg_trees_evaluated'] = trees / (count - errors) if count > errors else 0.0
+        yield json.dumps(summary) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of request, stage-latency and cache metrics"""
+    cache_stats = cache.stats()
+    extra = [
+        ('prediction_cache_events_total', 'counter', 'Prediction cache lookups by outcome',
+         [({'event': event}, cache_stats[event]) for event in ('hits', 'misses', 'evictions')]),
+        ('prediction_cache_entries', 'gauge', 'Entries in the prediction cache',
+         [({}, cache_stats['size'])]),
+        ('model_info', 'gauge', 'Currently served model version',
+         [({'version': reloader.current.version}, 1)]),
+        ('model_resident_bytes', 'gauge', 'Memory held by each resident registry model',
+         [({'model': model_id, 'version': version}, nbytes)
+          for model_id, version, nbytes in registry.resident()]),
+    ]
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+def early_exit_stats():
+    rows = early_exit_rows.value()
+    trees = early_exit_trees.value()
+    return {
+        'rows': rows,
+        'trees_evaluated': trees,
+        'avg_trees_evaluated': trees / rows if rows else 0.0,
+        'n_trees': reloader.current.engine.n_trees
+    }
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Runtime statistics of the serving components"""
+    return jsonify({
+        'model_version': reloader.current.version,
+        'model': reloader.stats(),
+        'model_registry': registry.stats(),
+        'startup': startup.as_dict(),
+        'prediction_cache': cache.stats(),
+        'micro_batcher': batcher.stats() if batcher is not None else None,
+        'cascade': cascade.stats() if cascade is not None else None,
+        'early_exit': early_exit_stats(),
+        'sessions': sessions.stats(),
+        'similar_students': reference_set.stats() if reference_set is not None else None,
+        'rosters': rosters.stats() if rosters is not None else None,
+        'status': 'success'
+    })
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """Load, benchmark and swap in the model files currently on disk.
+
+    Requires the ``X-Admin-Token`` header to match ADMIN_TOKEN; while no
+    token is configured the endpoint is disabled. ``?force=1`` skips the
+    latency guard.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Set ADMIN_TOKEN to enable /admin/reload', 'status': 'error'}), 403
+    if not has_admin_token():
+        return jsonify({'error': 'Not authorized to reload the model', 'status': 'error'}), 403
+
+    force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+    report = reloader.reload(force=force)
+    code = {'failed': 500, 'rejected': 409}.get(report['status'], 200)
+    return jsonify(report), code
+
 @app.route('/feature_info', methods=['GET'])
 def feature_info():
     """Provide information about features for the frontend"""
-    feature_info = {
-        'categorical_features': {
-            'sex': ['M', 'F'],
-            'address': ['U', 'R'],  # Urban, Rural
-            'famsize': ['LE3', 'GT3'],  # <=3, >3
-            'Pstatus': ['T', 'A'],  # Together, Apart
-            'schoolsup': ['yes', 'no'],
-            'famsup': ['yes', 'no'],
-            'paid': ['yes', 'no'],
-            'activities': ['yes', 'no'],
-            'internet': ['yes', 'no'],
-            'romantic': ['yes', 'no']
+    return jsonify(FEATURE_INFO)
+
+@app.route('/what_if', methods=['POST'])
+def what_if():
+    """Score one student at every combination of values of the chosen features.
+
+    The body is ``{"student": {...}, "vary": ["studytime", "absences"]}``.
+    The grid and the unchanged student are scored in one model call.
+    """
+    request_counters['what_if'].inc()
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('what_if', e)
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise ValueError("Expected {'student': {...}, 'vary': [...]}")
+        features = data.get('vary')
+        if not isinstance(features, list):
+            raise ValueError("'vary' must be a list of feature names")
+        row = model.encoder.encode(data.get('student'))
+        values, shape, grid = sweep_grid(model.encoder, row, features, FEATURE_INFO,
+                                         MAX_WHAT_IF_POINTS)
+
+        started = time.perf_counter()
+        probas = model.engine.predict_proba(np.vstack([grid, row]))
+        registry.observe_latency(model.model_id, time.perf_counter() - started)
+        surface = probas[:-1, 1].reshape(shape)
+        baseline = probas[-1]
+        best = np.unravel_index(surface.argmax(), shape)
+
+        return jsonify({
+            'features': features,
+            'values': values,
+            'shape': list(shape),
+            'grid_size': int(surface.size),
+            'pass_probability': surface.tolist(),
+            'baseline': {
+                'prediction': int(model.engine.classes[baseline.argmax()]),
+                'probability': {'fail': float(baseline[0]), 'pass': float(baseline[1])}
+            },
+            'best': {
+                'values': {feature: values[feature][i] for feature, i in zip(features, best)},
+                'pass_probability': float(surface[best])
+            },
+            'model_id': model.model_id,
+            'model_version': model.version,
+            'status': 'success'
+        })
+
+    except Exception as e:
+        error_counters['what_if'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+@app.route('/counterfactual', methods=['POST'])
+def counterfactual_search():
+    """Find the fewest actionable changes that turn a predicted Fail into a Pass.
+
+    The body is ``{"student": {...}}`` plus optional ``features`` (a subset
+    of the actionable features), ``max_changes``, ``limit`` and
+    ``budget_ms``.
+    """
+    request_counters['counterfactual'].inc()
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('counterfactual', e)
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise ValueError("Expected {'student': {...}}")
+        features = data.get('features', list(counterfactual.ACTIONABLE_FEATURES))
+        if not isinstance(features, list):
+            raise ValueError("'features' must be a list of feature names")
+        for feature in features:
+            if feature not in counterfactual.ACTIONABLE_FEATURES:
+                raise ValueError(f"Feature '{feature}' cannot be changed")
+        max_changes = int(data.get('max_changes', 3))
+        limit = int(data.get('limit', 3))
+        budget_ms = float(data.get('budget_ms', 250))
+        if not 1 <= max_changes <= MAX_COUNTERFACTUAL_CHANGES:
+            raise ValueError(f'max_changes must be between 1 and {MAX_COUNTERFACTUAL_CHANGES}')
+        if not 1 <= limit <= MAX_COUNTERFACTUAL_RESULTS:
+            raise ValueError(f'limit must be between 1 and {MAX_COUNTERFACTUAL_RESULTS}')
+        if not 0 < budget_ms <= MAX_COUNTERFACTUAL_BUDGET_MS:
+            raise ValueError(f'budget_ms must be between 0 and {MAX_COUNTERFACTUAL_BUDGET_MS}')
+        row = model.encoder.encode(data.get('student'))
+
+        started = time.perf_counter()
+        predictions, probas = model.engine.predict(row)
+        if predictions[0] == counterfactual.PASS_LABEL:
+            # Already predicted to pass: nothing to change
+            result = {'interventions': [], 'candidates_scored': 0, 'complete': True}
+        else:
+            result = counterfactual.search(model.engine, model.encoder, row, FEATURE_INFO,
+                                           features=features, max_changes=max_changes,
+                                           limit=limit, budget_ms=budget_ms)
+        registry.observe_latency(model.model_id, time.perf_counter() - started)
+
+        result.update({
+            'baseline': {
+                'prediction': int(predictions[0]),
+                'probability': {'fail': float(probas[0][0]), 'pass': float(probas[0][1])}
+            },
+            'elapsed_ms': (time.perf_counter() - started) * 1000.0,
+            'model_id': model.model_id,
+            'model_version': model.version,
+            'status': 'success'
+        })
+        return jsonify(result)
+
+    except Exception as e:
+        error_counters['counterfactual'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+def session_response(session_id, session, changed, trees, started):
+    model = session.model
+    prediction, prediction_proba, contributions = session.explain()
+    registry.observe_latency(model.model_id, time.perf_counter() - started)
+    return jsonify({
+        'session_id': session_id,
+        'prediction': int(prediction),
+        'prediction_text': 'Pass' if prediction == 1 else 'Fail',
+        'probability': {
+            'fail': float(prediction_proba[0]),
+            'pass': float(prediction_proba[1])
         },
-        'numerical_features': {
-            'age': {'min': 15, 'max': 19, 'description': 'Student age'},
-            'Medu': {'min': 0, 'max': 4, 'description': 'Mother education level'},
-            'Fedu': {'min': 0, 'max': 4, 'description': 'Father education level'},
-            'studytime': {'min': 1, 'max': 4, 'description': 'Weekly study time'},
-            'failures': {'min': 0, 'max': 3, 'description': 'Number of past class failures'},
-            'famrel': {'min': 1, 'max': 5, 'description': 'Quality of family relationships'},
-            'freetime': {'min': 1, 'max': 5, 'description': 'Free time after school'},
-            'goout': {'min': 1, 'max': 5, 'description': 'Going out with friends'},
-            'health': {'min': 1, 'max': 5, 'description': 'Current health status'},
-            'absences': {'min': 0, 'max': 20, 'description': 'Number of school absences'}
-        }
+        'confidence': float(max(prediction_proba)),
+        'top_factors': top_factors(model, contributions[np.newaxis])[0],
+        'changed': changed,
+        'trees_recomputed': trees,
+        'n_trees': model.engine.n_trees,
+        'model_id': model.model_id,
+        'model_version': model.version,
+        'status': 'success'
+    })
+
+def session_not_found(session_id):
+    error_counters['sessions'].inc()
+    return jsonify({'error': f"Unknown or expired session '{session_id}'",
+                    'status': 'error'}), 404
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """Score a student and keep the per-tree state for later deltas"""
+    request_counters['sessions'].inc()
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('sessions', e)
+    try:
+        data = request.get_json()
+        started = time.perf_counter()
+        session = ScoringSession(model, data)
+        session_id = sessions.create(session)
+        return session_response(session_id, session, list(model.encoder.columns),
+                                model.engine.n_trees, started)
+    except Exception as e:
+        error_counters['sessions'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+@app.route('/sessions/<session_id>', methods=['PATCH'])
+def update_session(session_id):
+    """Apply changed fields to a session and re-score only the affected trees"""
+    request_counters['sessions'].inc()
+    session = sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+    try:
+        data = request.get_json()
+        started = time.perf_counter()
+        with session.lock:
+            # Follow reloads of the session's model; the state is rebuilt
+            # when the version changes
+            changed, trees = session.update(model_for(session.model.model_id), data)
+            sessions.record_update(trees)
+            return session_response(session_id, session, changed, trees, started)
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('sessions', e)
+    except Exception as e:
+        error_counters['sessions'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return session_not_found(session_id)
+    return jsonify({'status': 'success'})
+
+@app.route('/similar_students', methods=['POST'])
+def similar_students():
+    """Reference students that share the most leaves with a student.
+
+    The body is ``{"student": {...}}`` plus an optional ``k`` (default 10).
+    Queries use the default model.
+    """
+    request_counters['similar_students'].inc()
+    references = current_reference_set()
+    if references is None:
+        error_counters['similar_students'].inc()
+        message = ('The similarity index is still being built'
+                   if os.path.exists(REFERENCE_DATA_PATH) else 'No reference data is loaded')
+        return jsonify({'error': message, 'status': 'error'}), 503
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise ValueError("Expected {'student': {...}}")
+        k = int(data.get('k', 10))
+        if not 1 <= k <= MAX_SIMILAR_STUDENTS:
+            raise ValueError(f'k must be between 1 and {MAX_SIMILAR_STUDENTS}')
+
+        started = time.perf_counter()
+        neighbours, scored, exact = references.similar(data.get('student'), k)
+        return jsonify({
+            'neighbours': neighbours,
+            'exact': exact,
+            'rows_scored': scored,
+            'reference_rows': references.index.n_rows,
+            'n_trees': references.model.engine.n_trees,
+            'elapsed_ms': (time.perf_counter() - started) * 1000.0,
+            'model_version': references.model.version,
+            'status': 'success'
+        })
+
+    except Exception as e:
+        error_counters['similar_students'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+@app.route('/cohort_analytics', methods=['POST'])
+def cohort_analytics():
+    """Score an NDJSON or CSV cohort and aggregate its predictions by group.
+
+    ``?group_by=address,famsize,address*internet`` lists the breakdowns;
+    ``?bins=`` sets the number of probability histogram bins.
+    """
+    request_counters['cohort_analytics'].inc()
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('cohort_analytics', e)
+    try:
+        fmt = detect_format(request.content_type, request.args.get('format'))
+        breakdowns = parse_breakdowns(request.args.get('group_by'), model.encoder)
+        bins = int(request.args.get('bins', 10))
+        if not 1 <= bins <= MAX_COHORT_BINS:
+            raise ValueError(f'bins must be between 1 and {MAX_COHORT_BINS}')
+        aggregator = CohortAggregator(model.encoder, breakdowns, bins=bins,
+                                      max_groups=MAX_COHORT_GROUPS)
+
+        started = time.perf_counter()
+        pass_index = int(np.flatnonzero(model.engine.classes == counterfactual.PASS_LABEL)[0])
+        count = 0
+        errors = 0
+        # The body is consumed in chunks, never loaded as a whole
+        chunks = iter_column_chunks(iter_lines(request.stream), fmt, COHORT_CHUNK_SIZE,
+                                    model.encoder.columns)
+        for values, n_rows, chunk_errors in chunks:
+            matrix, positions, encode_errors = model.encoder.encode_columns(values, n_rows)
+            if chunk_errors:
+                keep = [i for i, position in enumerate(positions) if position not in chunk_errors]
+                matrix = matrix[keep]
+            count += n_rows
+            errors += len(set(chunk_errors) | set(encode_errors))
+            if len(matrix):
+                labels, probas = model.engine.predict(matrix)
+                aggregator.add(matrix, labels, probas[:, pass_index])
+        registry.observe_latency(model.model_id, time.perf_counter() - started)
+
+        result = aggregator.result()
+        result.update({
+            'count': count,
+            'errors': errors,
+            'elapsed_ms': (time.perf_counter() - started) * 1000.0,
+            'model_id': model.model_id,
+            'model_version': model.version,
+            'status': 'success'
+        })
+        return jsonify(result)
+
+    except Exception as e:
+        error_counters['cohort_analytics'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+def page_size_arg(name='page_size'):
+    page_size = int(request.args.get(name, AT_RISK_PAGE_SIZE))
+    if not 1 <= page_size <= MAX_AT_RISK_PAGE_SIZE:
+        raise ValueError(f'{name} must be between 1 and {MAX_AT_RISK_PAGE_SIZE}')
+    return page_size
+
+def ranking_page(ranking_id, ranking, cursor, page_size):
+    results, next_cursor = ranking.page(cursor, page_size)
+    return {
+        'ranking_id': ranking_id,
+        'results': results,
+        'next_cursor': next_cursor,
+        'ranked': len(ranking.rows),
+        'count': ranking.count,
+        'errors': ranking.errors,
+        'model_id': ranking.model.model_id,
+        'model_version': ranking.model.version,
+        'status': 'success'
     }
 
-    return jsonify(feature_info)
+@app.route('/at_risk', methods=['POST'])
+def at_risk():
+    """Rank an NDJSON or CSV roster and keep the ``k`` lowest pass probabilities.
+
+    Returns the first page of the ranking and a ``ranking_id`` for the
+    rest. ``?id_field=`` names a column carried into every result.
+    """
+    request_counters['at_risk'].inc()
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('at_risk', e)
+    try:
+        fmt = detect_format(request.content_type, request.args.get('format'))
+        k = int(request.args.get('k', 100))
+        if not 1 <= k <= MAX_AT_RISK_K:
+            raise ValueError(f'k must be between 1 and {MAX_AT_RISK_K}')
+        page_size = page_size_arg()
+        id_field = request.args.get('id_field')
+        columns = list(model.encoder.columns)
+        if id_field and id_field not in columns:
+            columns.append(id_field)
+
+        started = time.perf_counter()
+        pass_index = int(np.flatnonzero(model.engine.classes == counterfactual.PASS_LABEL)[0])
+        selector = TopKSelector(k)
+        count = 0
+        errors = 0
+        trees = 0
+        # The body is consumed in chunks; only the k students ranked so far are kept
+        chunks = iter_column_chunks(iter_lines(request.stream), fmt, COHORT_CHUNK_SIZE, columns)
+        for values, n_rows, chunk_errors in chunks:
+            matrix, positions, encode_errors = model.encoder.encode_columns(values, n_rows)
+            if chunk_errors:
+                keep = [i for i, position in enumerate(positions) if position not in chunk_errors]
+                matrix, positions = matrix[keep], [positions[i] for i in keep]
+            errors += len(set(chunk_errors) | set(encode_errors))
+            if positions:
+                rows, probas, evaluated = model.engine.proba_at_most(matrix, selector.limit,
+                                                                     pass_index)
+                trees += evaluated
+                positions = np.asarray(positions)[rows]
+
+                def entry(i, positions=positions, probas=probas, matrix=matrix[rows]):
+                    position = int(positions[i])
+                    proba = probas[i]
+                    prediction = int(model.engine.classes[proba.argmax()])
+                    result = {
+                        'index': count + position,
+                        'prediction': prediction,
+                        'prediction_text': 'Pass' if prediction == 1 else 'Fail',
+                        'probability': {'fail': float(proba[0]), 'pass': float(proba[1])},
+                        'student': model.encoder.decode(matrix[i])
+                    }
+                    if id_field:
+                        result['id'] = values[id_field][position] if id_field in values else None
+                    return result
+
+                selector.add(probas[:, pass_index], count + positions, payload=entry)
+            count += n_rows
+        registry.observe_latency(model.model_id, time.perf_counter() - started)
+
+        ranking = Ranking(selector, model, count, errors)
+        ranking_id = rankings.create(ranking)
+        body = ranking_page(ranking_id, ranking, None, page_size)
+        body.update({
+            'k': k,
+            'avg_trees_evaluated': trees / (count - errors) if count > errors else 0.0,
+            'elapsed_ms': (time.perf_counter() - started) * 1000.0
+        })
+        return jsonify(body)
+
+    except Exception as e:
+        error_counters['at_risk'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+@app.route('/at_risk/<ranking_id>', methods=['GET'])
+def at_risk_page(ranking_id):
+    """The page of a ranking after ``?cursor=``"""
+    ranking = rankings.get(ranking_id)
+    if ranking is None:
+        return jsonify({'error': f"Unknown or expired ranking '{ranking_id}'",
+                        'status': 'error'}), 404
+    try:
+        return jsonify(ranking_page(ranking_id, ranking, request.args.get('cursor'),
+                                    page_size_arg()))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+def roster_not_found(e):
+    error_counters['rosters'].inc()
+    return jsonify({'error': e.args[0], 'status': 'error'}), 404
+
+def roster_rows(model, chunks):
+    """Encoded chunks of an upload, rejecting it at the first invalid row"""
+    count = 0
+    for values, n_rows, chunk_errors in chunks:
+        matrix, positions, encode_errors = model.encoder.encode_columns(values, n_rows)
+        errors = {**encode_errors, **chunk_errors}
+        if errors:
+            position = min(errors)
+            raise ValueError(f'Row {count + position}: {errors[position]}')
+        count += n_rows
+        if n_rows:
+            yield matrix
+
+@app.route('/rosters', methods=['POST'])
+def create_roster():
+    """Store an NDJSON or CSV roster with its scores under the default model.
+
+    Students keep their upload order as row numbers, so an upload with any
+    invalid row is rejected as a whole. ``?name=`` labels the roster.
+    """
+    request_counters['rosters'].inc()
+    model = reloader.current
+    try:
+        fmt = detect_format(request.content_type, request.args.get('format'))
+        started = time.perf_counter()
+        chunks = iter_column_chunks(iter_lines(request.stream), fmt, COHORT_CHUNK_SIZE,
+                                    model.encoder.columns)
+        roster = roster_store().create(model, roster_rows(model, chunks),
+                                       name=request.args.get('name'))
+        registry.observe_latency(model.model_id, time.perf_counter() - started)
+        body = roster.describe()
+        body.update({
+            'elapsed_ms': (time.perf_counter() - started) * 1000.0,
+            'model_version': model.version,
+            'status': 'success'
+        })
+        return jsonify(body), 201
+
+    except Exception as e:
+        error_counters['rosters'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+@app.route('/rosters', methods=['GET'])
+def list_rosters():
+    store = roster_store()
+    return jsonify({
+        'rosters': [store.get(roster_id).describe() for roster_id in store.ids()],
+        'status': 'success'
+    })
+
+@app.route('/rosters/<roster_id>', methods=['GET'])
+def get_roster(roster_id):
+    try:
+        return jsonify(dict(roster_store().get(roster_id).describe(), status='success'))
+    except RosterNotFound as e:
+        return roster_not_found(e)
+
+@app.route('/rosters/<roster_id>', methods=['DELETE'])
+def delete_roster(roster_id):
+    try:
+        roster_store().delete(roster_id)
+    except RosterNotFound as e:
+        return roster_not_found(e)
+    return jsonify({'status': 'success'})
+
+@app.route('/rosters/<roster_id>/scores', methods=['GET'])
+def roster_scores(roster_id):
+    """Stored scores of ``?limit=`` students from row ``?offset=``, read without the model"""
+    request_counters['rosters'].inc()
+    try:
+        roster = roster_store().get(roster_id)
+    except RosterNotFound as e:
+        return roster_not_found(e)
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = page_size_arg('limit')
+        if offset < 0:
+            raise ValueError('offset must not be negative')
+        return jsonify({
+            'roster_id': roster_id,
+            'results': roster.scores(offset, limit),
+            'offset': offset,
+            'n_rows': roster.n_rows,
+            'status': 'success'
+        })
+    except ValueError as e:
+        error_counters['rosters'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+@app.route('/rosters/<roster_id>/students/<int:row>', methods=['GET'])
+def get_roster_student(roster_id, row):
+    try:
+        roster = roster_store().get(roster_id)
+        return jsonify(dict(roster.student(row), status='success'))
+    except RosterNotFound as e:
+        return roster_not_found(e)
+    except IndexError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 404
+
+@app.route('/rosters/<roster_id>/students/<int:row>', methods=['PATCH'])
+def update_roster_student(roster_id, row):
+    """Apply changed fields to one student, re-scoring it only if its features changed"""
+    request_counters['rosters'].inc()
+    model = reloader.current
+    try:
+        roster = roster_store().get(roster_id)
+    except RosterNotFound as e:
+        return roster_not_found(e)
+    try:
+        started = time.perf_counter()
+        changed, rescored = roster.update(model, row, request.get_json())
+        if rescored:
+            registry.observe_latency(model.model_id, time.perf_counter() - started)
+        return jsonify(dict(roster.student(row), changed=changed, rescored=rescored,
+                            status='success'))
+    except IndexError as e:
+        error_counters['rosters'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 404
+    except Exception as e:
+        error_counters['rosters'].inc()
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+@app.route('/partial_dependence', methods=['GET'])
+def partial_dependence_endpoint():
+    """Partial-dependence curves over the reference students, ``?features=`` (default all)"""
+    request_counters['partial_dependence'].inc()
+    try:
+        model = resolve_model()
+    except (UnknownModel, ModelLoadError) as e:
+        return model_error('partial_dependence', e)
+    if not os.path.exists(REFERENCE_DATA_PATH):
+        error_counters['partial_dependence'].inc()
+        return jsonify({'error': 'No reference data is loaded', 'status': 'error'}), 503
+    try:
+        started = time.perf_counter()
+        report = partial_dependence_report(model)
+        curves = report['curves']
+        if request.args.get('features'):
+            by_feature = {curve['feature']: curve for curve in curves}
+            curves = []
+            for col in request.args['features'].split(','):
+                if col.strip() not in by_feature:
+                    raise ValueError(f"Unknown feature '{col.strip()}'")
+                curves.append(by_feature[col.strip()])
+        return jsonify(dict(report, curves=curves,
+                            elapsed_ms=(time.perf_counter() - started) * 1000.0,
+                            status='success'))
+
+    except Exception as e:
+        error_counters['partial_dependence'].inc()
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+def startup_report():
+    """Time a first prediction and print the startup report"""
+    model = reloader.current
+    with startup.phase('first prediction'):
+        model.engine.explain(model.encoder.encode({}))
+    print(format_report(startup, import_times('app')))
+
 
 if __name__ == '__main__':
+    if '--startup-report' in sys.argv:
+        startup_report()
+        sys.exit(0)
     print("Starting Student Performance Prediction API...")
     print("Model loaded successfully!")
+    # Background work that importing app leaves for first use
+    current_reference_set()
+    roster_store()
     app.run(debug=True, host='0.0.0.0', port=5000)
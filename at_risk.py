@@ -0,0 +1,103 @@
+"""
+Top-K at-risk ranking: the students with the lowest pass probabilities.
+
+A roster is streamed through the model in chunks. ``TopKSelector`` keeps only
+the ``k`` lowest pass probabilities seen so far, with a partial selection
+(``np.partition``) per chunk instead of a sort of the whole roster, so
+memory is O(k) however long the roster is. Once ``k`` students are held,
+the current k-th probability bounds each chunk: the forest drops a row as
+soon as its remaining trees cannot bring it under that bound.
+
+Students are ordered by pass probability, then by their position in the
+roster, so a ranking and the cursors into it never depend on chunking.
+"""
+import base64
+
+import numpy as np
+
+
+class TopKSelector:
+    """The ``k`` rows with the lowest scores, ties going to the earlier row"""
+
+    def __init__(self, k):
+        self.k = int(k)
+        self.scores = np.empty(0)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.payloads = []
+
+    @property
+    def limit(self):
+        """Score a new row must not exceed to enter, inf until ``k`` rows are held"""
+        return self.scores.max() if len(self.scores) >= self.k else np.inf
+
+    def add(self, scores, rows, payload=None):
+        """Offer rows, in roster order after every row offered before.
+
+        ``payload(i)`` builds what is kept for the i-th offered row; it is
+        only called for rows still selected once the offer is settled.
+        """
+        enter = np.flatnonzero(scores <= self.limit)
+        if not len(enter):
+            return
+        scores = np.concatenate([self.scores, scores[enter]])
+        rows = np.concatenate([self.rows, np.asarray(rows)[enter]])
+
+        keep = np.arange(len(scores))
+        if len(scores) > self.k:
+            kth = np.partition(scores, self.k - 1)[self.k - 1]
+            below = np.flatnonzero(scores < kth)
+            # Rows are held in roster order, so the first ties are the earliest
+            tied = np.flatnonzero(scores == kth)[:self.k - len(below)]
+            keep = np.sort(np.concatenate([below, tied]))
+        self.scores = scores[keep]
+        self.rows = rows[keep]
+        # Payloads are built after the selection, for the new rows it keeps
+        held = len(self.payloads)
+        self.payloads = [self.payloads[i] if i < held
+                         else payload(enter[i - held]) if payload is not None else None
+                         for i in keep]
+
+    def ranked(self):
+        """``(scores, rows, payloads)`` from the lowest score up"""
+        order = np.lexsort((self.rows, self.scores))
+        return self.scores[order], self.rows[order], [self.payloads[i] for i in order]
+
+
+class Ranking:
+    """A finished ranking, paged through with cursors"""
+
+    def __init__(self, selector, model, count, errors):
+        self.scores, self.rows, self.entries = selector.ranked()
+        self.model = model
+        self.count = count
+        self.errors = errors
+
+    def page(self, cursor=None, size=50):
+        """The entries after ``cursor``, and the cursor of the next page or None"""
+        start = 0
+        if cursor is not None:
+            score, row = decode_cursor(cursor)
+            # First entry ordered after (score, row)
+            start = int(np.searchsorted(self.scores, score, side='left'))
+            while start < len(self.scores) and (self.scores[start], self.rows[start]) <= (score, row):
+                start += 1
+        end = min(start + size, len(self.scores))
+        entries = [dict(self.entries[i], rank=i + 1) for i in range(start, end)]
+        next_cursor = (encode_cursor(self.scores[end - 1], self.rows[end - 1])
+                       if end < len(self.scores) else None)
+        return entries, next_cursor
+
+
+def encode_cursor(score, row):
+    """Opaque cursor for the position after ``(score, row)``; exact for any float"""
+    token = f'{float(score).hex()}:{int(row)}'.encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        score, row = token.split(':')
+        return float.fromhex(score), int(row)
+    except ValueError:
+        raise ValueError('Invalid cursor') from None
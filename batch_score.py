@@ -0,0 +1,198 @@
+"""
+Offline batch scoring of large student CSV files.
+
+Reads the input in chunks with compact dtypes, scores the chunks on a pool
+of worker processes (each loads the model once) and writes predictions in
+input order to CSV or Parquet. Encoding and column order are shared with
+app.py. Rows with a malformed number are left out of the output and listed
+on stderr; the rest of the file is still scored.
+
+Usage:
+    python batch_score.py roster.csv predictions.csv --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from feature_encoder import CATEGORICAL_COLUMNS, REQUIRED_COLUMNS
+from model_artifact import ARTIFACT_PATH, ENCODERS_PATH, MODEL_PATH, REFERENCE_CSV, load_model
+
+# Compact dtypes for the categorical columns. Numerical columns are parsed by
+# pandas and checked per chunk, so a malformed cell only costs its own row
+INPUT_DTYPES = {col: 'category' for col in CATEGORICAL_COLUMNS}
+NUMERICAL_COLUMNS = [col for col in REQUIRED_COLUMNS if col not in CATEGORICAL_COLUMNS]
+
+# Invalid rows listed on stderr; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# Per-process state, set once by _init_worker
+_engine = None
+_encoder = None
+
+
+def _init_worker(artifact_path, model_path, encoders_path, reference_csv):
+    global _engine, _encoder
+    # The artifact is memory-mapped, so all workers share its pages
+    _engine, _encoder, _ = load_model(artifact_path, model_path, encoders_path, reference_csv)
+
+
+def score_chunk(chunk):
+    """Score one DataFrame chunk, returning (labels, probabilities)"""
+    labels, probas = _engine.predict(_encoder.encode_frame(chunk))
+    return labels.astype(np.int8), probas
+
+
+def read_chunks(path, chunk_size):
+    """Yield (rows, chunk, errors) for each chunk of the input.
+
+    Numerical columns are converted to float32; blanks stay NaN. Rows with
+    a value that is not a finite number are dropped from ``chunk`` and
+    described in ``errors``, a {row: message} dict. ``rows`` are the 0-based
+    input rows left in ``chunk``.
+    """
+    reader = pd.read_csv(path, chunksize=chunk_size, dtype=INPUT_DTYPES,
+                         usecols=lambda col: col in REQUIRED_COLUMNS)
+    start = 0
+    for chunk in reader:
+        rows = np.arange(start, start + len(chunk))
+        start += len(chunk)
+        errors = {}
+        for col in NUMERICAL_COLUMNS:
+            if col not in chunk:
+                continue
+            values = chunk[col]
+            # A column holding a malformed cell is read as strings
+            numbers = (values if pd.api.types.is_numeric_dtype(values)
+                       else pd.to_numeric(values, errors='coerce'))
+            invalid = values.notna().to_numpy() & ~np.isfinite(numbers.to_numpy(dtype=np.float64))
+            for position in np.flatnonzero(invalid):
+                errors.setdefault(int(rows[position]),
+                                  f"Invalid value for '{col}': '{values.iloc[position]}'")
+            chunk[col] = numbers.astype(np.float32)
+        if errors:
+            keep = ~np.isin(rows, list(errors))
+            chunk, rows = chunk[keep], rows[keep]
+        yield rows, chunk, errors
+
+
+def iter_scored_chunks(path, chunk_size, workers, loader_args):
+    """Yield (rows, labels, probas, errors) in input order, as ``read_chunks``.
+
+    At most two chunks per worker are in flight, so memory does not grow
+    with the size of the input file.
+    """
+    chunks = read_chunks(path, chunk_size)
+    if workers <= 0:
+        _init_worker(*loader_args)
+        for rows, chunk, errors in chunks:
+            yield (rows,) + score_chunk(chunk) + (errors,)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=loader_args) as pool:
+        pending = deque()
+        for rows, chunk, errors in chunks:
+            pending.append((rows, pool.submit(score_chunk, chunk), errors))
+            if len(pending) >= 2 * workers:
+                rows, future, errors = pending.popleft()
+                yield (rows,) + future.result() + (errors,)
+        while pending:
+            rows, future, errors = pending.popleft()
+            yield (rows,) + future.result() + (errors,)
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.header = True
+
+    def write(self, frame):
+        frame.to_csv(self.file, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('Parquet output requires pyarrow: pip install pyarrow')
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        table = self.pa.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_writer(path):
+    if path.endswith('.parquet'):
+        return ParquetWriter(path)
+    return CsvWriter(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score a student CSV file offline.')
+    parser.add_argument('input', help='CSV file with the student_data.csv columns')
+    parser.add_argument('output', help='Output file (.csv or .parquet)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (0 scores in this process)')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Rows per chunk')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH,
+                        help='Memory-mapped model artifact (used when it exists)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--encoders', default=ENCODERS_PATH)
+    parser.add_argument('--reference-csv', default=REFERENCE_CSV,
+                        help='Training data used for unseen-category fallbacks')
+    args = parser.parse_args(argv)
+
+    loader_args = (args.artifact, args.model, args.encoders, args.reference_csv)
+    writer = open_writer(args.output)
+    started = time.perf_counter()
+    scored = 0
+    invalid = 0
+    try:
+        for rows, labels, probas, errors in iter_scored_chunks(args.input, args.chunk_size,
+                                                               args.workers, loader_args):
+            for row, message in errors.items():
+                if invalid < MAX_REPORTED_ERRORS:
+                    print(f'Row {row}: {message}', file=sys.stderr)
+                invalid += 1
+            writer.write(pd.DataFrame({
+                'row': rows,
+                'prediction': labels,
+                'probability_fail': probas[:, 0],
+                'probability_pass': probas[:, 1]
+            }))
+            scored += len(rows)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f'Scored {scored} rows in {elapsed:.2f}s ({scored / elapsed:,.0f} rows/sec)',
+          file=sys.stderr)
+    if invalid:
+        print(f'Skipped {invalid} rows with invalid values', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Cascade serving: a tiny distilled tree answers first, the forest only when unsure.
+
+The distilled model is one shallow decision tree fitted to the forest's own
+predictions over student_data.csv plus synthetic students. Every node holds
+the forest's mean class probabilities over the students that reach it, and
+every leaf its confidence: the share of held-out synthetic students, not
+used to fit the tree, for which the tree's label matches the forest's. Rows
+whose leaf confidence is below the threshold are escalated to the full
+forest.
+
+The tree is stored as a one-tree model artifact, so it loads the same way as
+the forest:
+
+    python cascade.py --max-depth 8 --threshold 0.97
+"""
+import argparse
+import threading
+
+import numpy as np
+
+from model_artifact import load_artifact
+
+CASCADE_PATH = 'student_performance_model.cascade.spm'
+
+
+class Cascade:
+    """A distilled tree and the confidence threshold for escalation.
+
+    ``teacher_version`` is the version of the forest the tree was distilled
+    from; the cascade must only front that forest.
+    """
+
+    def __init__(self, engine, confidence, threshold, teacher_version):
+        self.engine = engine
+        self.confidence = np.asarray(confidence, dtype=np.float64)
+        self.threshold = float(threshold)
+        self.teacher_version = teacher_version
+        self.leaf_contributions = path_contributions(engine)
+        self.answered = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=CASCADE_PATH, threshold=None):
+        engine, _, manifest = load_artifact(path)
+        metadata = manifest['metadata']
+        if threshold is None:
+            threshold = metadata['threshold']
+        return cls(engine, metadata['confidence'], threshold, metadata['teacher_version'])
+
+    def explain(self, X):
+        """Return (confident, labels, probabilities, contributions) for each row.
+
+        ``confident`` marks the rows the distilled tree may answer; the other
+        rows must be escalated to the forest.
+        """
+        # With a single tree, everything follows from the leaf a row reaches
+        leaves = self.engine.apply(X)[:, 0]
+        confident = self.confidence[leaves] >= self.threshold
+        proba = self.engine.value[leaves]
+        labels = self.engine.classes[proba.argmax(axis=1)]
+        contributions = self.leaf_contributions[leaves]
+        with self._lock:
+            answered = int(confident.sum())
+            self.answered += answered
+            self.escalated += len(confident) - answered
+        return (confident, labels, proba, contributions)
+
+    def stats(self):
+        with self._lock:
+            total = self.answered + self.escalated
+            return {
+                'threshold': self.threshold,
+                'teacher_version': self.teacher_version,
+                'answered': self.answered,
+                'escalated': self.escalated,
+                'escalation_rate': self.escalated / total if total else 0.0
+            }
+
+
+def path_contributions(engine):
+    """Decision-path contributions of reaching each node of a one-tree forest.
+
+    ``[node, feature, class]``; equal to ``engine.explain`` of any row that
+    ends in that node. Nodes are numbered so parents precede children.
+    """
+    n_nodes = engine.n_nodes
+    contributions = np.zeros((n_nodes, engine.n_features, engine.value.shape[1]))
+    for parent in range(n_nodes):
+        for child in (engine.left[parent], engine.right[parent]):
+            if child != parent:
+                contributions[child] = contributions[parent]
+                contributions[child, engine.feature[parent]] += (engine.value[child]
+                                                                 - engine.value[parent])
+    return contributions
+
+
+def synthetic_students(X, n, n_swap=3, seed=0):
+    """Real students with ``n_swap`` features replaced by other students' values.
+
+    Stays close to the training distribution while covering feature
+    combinations the data does not contain.
+    """
+    rng = np.random.default_rng(seed)
+    samples = X[rng.integers(0, len(X), n)].copy()
+    for _ in range(n_swap):
+        columns = rng.integers(0, X.shape[1], n)
+        samples[np.arange(n), columns] = X[rng.integers(0, len(X), n), columns]
+    return samples
+
+
+def distill(teacher, X, held_out, max_depth=8, min_samples_leaf=20, seed=0):
+    """Fit a shallow tree to the teacher forest's labels on ``X``.
+
+    Returns ``(engine, confidence)``: a one-tree FlatForest whose node
+    values are the teacher's mean probabilities over ``X``, and the
+    per-node share of the ``held_out`` rows on which the tree's label
+    agrees with the teacher's (0 for nodes no held-out row reaches).
+    """
+    from sklearn.tree import DecisionTreeClassifier
+
+    from forest_engine import FlatForest
+
+    teacher_labels, teacher_proba = teacher.predict(X)
+    tree = DecisionTreeClassifier(max_depth=max_depth, min_samples_leaf=min_samples_leaf,
+                                  random_state=seed)
+    tree.fit(X, teacher_labels)
+    engine = FlatForest.from_sklearn(tree)
+
+    # Mean teacher probabilities over the rows reaching each node
+    paths = tree.decision_path(X).tocsc().T
+    counts = np.asarray(paths.sum(axis=1)).ravel()
+    value = np.asarray(paths @ teacher_proba) / counts[:, np.newaxis]
+    node_labels = engine.classes[value.argmax(axis=1)]
+
+    # Label agreement over held-out rows, which the tree has not been fitted to
+    held_out_labels = teacher.predict(held_out)[0]
+    paths = tree.decision_path(held_out).tocsc().T
+    counts = np.asarray(paths.sum(axis=1)).ravel()
+    agree = (held_out_labels[np.newaxis, :] == node_labels[:, np.newaxis])
+    confidence = np.zeros(len(counts))
+    reached = counts > 0
+    confidence[reached] = np.asarray((paths.multiply(agree)).sum(axis=1)).ravel()[reached] \
+        / counts[reached]
+
+    engine = FlatForest.from_arrays(dict(engine.to_arrays(), value=value), engine.max_depth)
+    return engine, confidence
+
+
+def main(argv=None):
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+
+    from compress_model import RANDOM_STATE, TARGET_COLUMN, TEST_SIZE
+    from model_artifact import (ARTIFACT_PATH, ENCODERS_PATH, MODEL_PATH, REFERENCE_CSV,
+                                load_model, save_artifact)
+    from model_reloader import single_row_latency
+
+    parser = argparse.ArgumentParser(description='Distill the forest into a cascade tree.')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--encoders', default=ENCODERS_PATH)
+    parser.add_argument('--data', default=REFERENCE_CSV)
+    parser.add_argument('--output', default=CASCADE_PATH)
+    parser.add_argument('--max-depth', type=int, default=8)
+    parser.add_argument('--min-samples-leaf', type=int, default=20)
+    parser.add_argument('--synthetic', type=int, default=20000,
+                        help='Synthetic students added to the distillation set')
+    parser.add_argument('--held-out', type=int, default=20000,
+                        help='Synthetic students for leaf confidence, and as many for the report')
+    parser.add_argument('--threshold', type=float, default=0.97,
+                        help='Leaf confidence below which rows go to the forest')
+    args = parser.parse_args(argv)
+
+    teacher, encoder, version = load_model(args.artifact, args.model, args.encoders, args.data)
+    data = pd.read_csv(args.data)
+    X = encoder.encode_frame(data)
+    y = data[TARGET_COLUMN].to_numpy()
+    _, test_rows = train_test_split(np.arange(len(data)), test_size=TEST_SIZE,
+                                    random_state=RANDOM_STATE, stratify=y)
+
+    # Fitting, leaf confidence and the report each use their own students
+    distill_X = np.concatenate([X, synthetic_students(X, args.synthetic, seed=0)])
+    calibration_X = synthetic_students(X, args.held_out, seed=1)
+    report_X = synthetic_students(X, args.held_out, seed=2)
+    engine, confidence = distill(teacher, distill_X, calibration_X, args.max_depth,
+                                 args.min_samples_leaf)
+    manifest = save_artifact(args.output, engine, encoder, metadata={
+        'teacher_version': version,
+        'threshold': args.threshold,
+        'confidence': confidence.tolist()
+    })
+
+    # Report the cascade on fresh synthetic students, then on the real test split
+    cascade = Cascade(engine, confidence, args.threshold, version)
+    confident, labels, _, _ = cascade.explain(report_X)
+    agree = labels == teacher.predict(report_X)[0]
+    print(f"Wrote {args.output} ({engine.n_nodes} nodes, depth {engine.max_depth}, "
+          f"model version {manifest['model_version']}, distilled from {version})")
+    print(f'Escalated to the forest:     {1 - confident.mean():.1%} of fresh students')
+    print(f'Agreement with the forest:   {agree[confident].mean():.2%} of answered, '
+          f'{(agree | ~confident).mean():.2%} of all fresh students')
+
+    confident, labels, _, _ = cascade.explain(X)
+    teacher_labels = teacher.predict(X)[0]
+    cascade_labels = np.where(confident, labels, teacher_labels)
+    print(f'Held-out accuracy:           cascade {(cascade_labels == y)[test_rows].mean():.3f}, '
+          f'forest {(teacher_labels == y)[test_rows].mean():.3f}')
+    print(f'Single-row latency (p50):    distilled {single_row_latency(cascade, encoder):.3f}ms, '
+          f'forest {single_row_latency(teacher, encoder):.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
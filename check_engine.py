@@ -0,0 +1,97 @@
+"""
+Equivalence and throughput check of the flat-array engine against sklearn.
+
+The pickled RandomForestClassifier and the engine serving it score the same
+synthetic roster, resampled from the training data with numerical features
+jittered so that rows are not all copies. The check fails unless:
+
+    predict_proba   is bit-identical to RandomForestClassifier.predict_proba
+    apply           gives the same leaves through the bitmask tables as
+                    through a walk of the trees
+    early exit      labels and at-most probabilities agree with predict_proba
+    throughput      in rows/sec is at least --min-speedup times sklearn's,
+                    both on one core
+
+Usage:
+    python check_engine.py --rows 300000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from model_artifact import ARTIFACT_PATH, ENCODERS_PATH, MODEL_PATH, REFERENCE_CSV, load_model
+
+
+def synthetic_roster(encoder, data, n_rows, seed=0):
+    """``n_rows`` encoded students resampled from ``data``, numerical features jittered"""
+    rng = np.random.default_rng(seed)
+    X = encoder.encode_frame(data)[rng.integers(0, len(data), n_rows)]
+    for i, col in enumerate(encoder.columns):
+        if col not in encoder.classes:
+            X[:, i] = np.maximum(X[:, i] + rng.integers(-1, 2, n_rows), 0)
+    return X
+
+
+def rows_per_second(score, X):
+    started = time.perf_counter()
+    result = score(X)
+    return len(X) / (time.perf_counter() - started), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the engine against the sklearn model.')
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--min-speedup', type=float, default=1.0,
+                        help='Smallest accepted ratio of engine to sklearn throughput')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH,
+                        help='Model artifact to check (used when it exists)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--encoders', default=ENCODERS_PATH)
+    parser.add_argument('--data', default=REFERENCE_CSV)
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    model = joblib.load(args.model)
+    model.n_jobs = 1
+    engine, encoder, version = load_model(args.artifact, args.model, args.encoders, args.data)
+    X = synthetic_roster(encoder, pd.read_csv(args.data), args.rows)
+    failures = []
+
+    sklearn_rate, expected = rows_per_second(lambda X: model.predict_proba(X.astype(np.float32)), X)
+    engine.predict_proba(X[:1024])  # builds the bitmask tables
+    engine_rate, proba = rows_per_second(engine.predict_proba, X)
+    if not np.array_equal(proba, expected):
+        failures.append(f'predict_proba differs on {int((proba != expected).any(axis=1).sum())} rows')
+
+    sample = X[:20000].astype(np.float32)
+    if not np.array_equal(engine.apply(sample), engine._walk(sample, engine._walk_roots)):
+        failures.append('bitmask leaves differ from walked leaves')
+    labels, _ = engine.predict_early_exit(sample)
+    if not np.array_equal(labels, engine.classes[expected[:20000].argmax(axis=1)]):
+        failures.append('early-exit labels differ from predict')
+    limit = np.quantile(expected[:20000, 1], 0.1)
+    rows, at_most, _ = engine.proba_at_most(sample, limit, 1)
+    # Rows kept may still end above the limit, but none at or below it may be dropped
+    if not np.isin(np.flatnonzero(expected[:20000, 1] <= limit), rows).all() \
+            or not np.array_equal(at_most, expected[rows]):
+        failures.append('proba_at_most differs from predict_proba')
+
+    speedup = engine_rate / sklearn_rate
+    print(f'Model version {version}, {args.rows} rows')
+    print(f'  sklearn  {sklearn_rate:>10,.0f} rows/sec')
+    print(f'  engine   {engine_rate:>10,.0f} rows/sec ({speedup:.2f}x)')
+    if speedup < args.min_speedup:
+        failures.append(f'engine is {speedup:.2f}x sklearn, below {args.min_speedup:.2f}x')
+    for failure in failures:
+        print(f'FAILED: {failure}', file=sys.stderr)
+    if not failures:
+        print('OK: probabilities bit-identical to sklearn')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
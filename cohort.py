@@ -0,0 +1,126 @@
+"""
+Cohort analytics: predictions of a whole cohort aggregated by group.
+
+A cohort is scored chunk by chunk. Each chunk is grouped by every requested
+breakdown (one feature, or several crossed with ``*``) on the encoded
+feature values, and its counts, predicted passes, probability sums and
+probability histograms are added to the running totals with ``bincount``.
+Memory depends on the number of groups, not on the size of the cohort.
+"""
+import numpy as np
+
+from counterfactual import PASS_LABEL
+
+
+def parse_breakdowns(spec, encoder):
+    """Breakdowns from ``'address,famsize,address*internet'`` as column tuples"""
+    breakdowns = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        columns = tuple(col.strip() for col in part.split('*'))
+        for col in columns:
+            if col not in encoder.columns:
+                raise ValueError(f"Unknown feature '{col}'")
+        if len(set(columns)) != len(columns):
+            raise ValueError(f"Repeated feature in '{part}'")
+        if columns not in breakdowns:
+            breakdowns.append(columns)
+    return breakdowns
+
+
+class CohortAggregator:
+    """Running per-group totals of a cohort's predictions.
+
+    ``breakdowns`` is a list of column tuples; the histogram of pass
+    probabilities has ``bins`` equal-width bins over [0, 1]. A breakdown
+    with more than ``max_groups`` distinct groups raises ValueError.
+    """
+
+    def __init__(self, encoder, breakdowns, bins=10, max_groups=1000):
+        self.encoder = encoder
+        self.bins = int(bins)
+        self.max_groups = int(max_groups)
+        self.breakdowns = [(columns, [encoder.columns.index(col) for col in columns], {})
+                           for columns in breakdowns]
+        self.overall = np.zeros(3 + self.bins)
+
+    def add(self, matrix, labels, pass_proba):
+        """Add one scored chunk: encoded rows, predicted labels and pass probabilities"""
+        n_rows = len(pass_proba)
+        if not n_rows:
+            return
+        passed = (labels == PASS_LABEL).astype(np.float64)
+        bin_index = np.minimum((pass_proba * self.bins).astype(np.intp), self.bins - 1)
+        self.overall += self._totals(np.zeros(n_rows, dtype=np.intp), 1,
+                                     passed, pass_proba, bin_index)[0]
+
+        for columns, indices, groups in self.breakdowns:
+            keys, inverse = _group(matrix[:, indices])
+            totals = self._totals(inverse, len(keys), passed, pass_proba, bin_index)
+            for key, row in zip(map(tuple, keys), totals):
+                if key in groups:
+                    groups[key] += row
+                else:
+                    if len(groups) >= self.max_groups:
+                        raise ValueError(f"Breakdown '{'*'.join(columns)}' has more than "
+                                         f'{self.max_groups} groups')
+                    groups[key] = row
+
+    def _totals(self, group, n_groups, passed, pass_proba, bin_index):
+        """Per group: count, predicted passes, probability sum, histogram"""
+        totals = np.empty((n_groups, 3 + self.bins))
+        totals[:, 0] = np.bincount(group, minlength=n_groups)
+        totals[:, 1] = np.bincount(group, weights=passed, minlength=n_groups)
+        totals[:, 2] = np.bincount(group, weights=pass_proba, minlength=n_groups)
+        totals[:, 3:] = np.bincount(group * self.bins + bin_index,
+                                    minlength=n_groups * self.bins).reshape(n_groups, self.bins)
+        return totals
+
+    def _summary(self, totals):
+        count = int(totals[0])
+        return {
+            'count': count,
+            'predicted_pass': int(totals[1]),
+            'pass_rate': totals[1] / count if count else None,
+            'mean_pass_probability': totals[2] / count if count else None,
+            'histogram': totals[3:].astype(int).tolist()
+        }
+
+    def _decode(self, col, code):
+        classes = self.encoder.classes.get(col)
+        if classes is not None:
+            return classes[int(code)]
+        return int(code) if float(code).is_integer() else float(code)
+
+    def result(self):
+        """The overall summary and every breakdown, groups in encoded order"""
+        return {
+            'overall': self._summary(self.overall),
+            'bin_edges': np.linspace(0.0, 1.0, self.bins + 1).tolist(),
+            'breakdowns': [{
+                'features': list(columns),
+                'groups': [dict(self._summary(groups[key]),
+                                values={col: self._decode(col, code)
+                                        for col, code in zip(columns, key)})
+                           for key in sorted(groups)]
+            } for columns, _, groups in self.breakdowns]
+        }
+
+
+def _group(values):
+    """Distinct rows of ``values`` and each row's group, as ``np.unique(axis=0)``.
+
+    Each column is factorized on its own and the codes are combined into a
+    single integer key, which sorts much faster than whole rows.
+    """
+    uniques, codes = zip(*(np.unique(column, return_inverse=True) for column in values.T))
+    shape = tuple(len(unique) for unique in uniques)
+    if np.prod(shape, dtype=np.float64) >= 2 ** 62:
+        keys, inverse = np.unique(values, axis=0, return_inverse=True)
+        return keys, inverse.ravel()
+    combined, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    keys = np.column_stack([unique[index] for unique, index
+                            in zip(uniques, np.unravel_index(combined, shape))])
+    return keys, inverse.ravel()
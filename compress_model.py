@@ -0,0 +1,386 @@
+"""
+Accuracy-bounded compression of the trained forest.
+
+Run after script_1.py. Starting from the trained model, every tree is
+first cut one level shorter at a time, then trees are dropped greedily,
+then subtrees are collapsed into leaves, as long as the compressed model
+stays within the given tolerances of the original:
+
+    accuracy      on the validation half of the held-out split script_1.py
+                  trained without
+    agreement     share of all students in the data whose predicted label
+                  is unchanged
+    proba delta   mean absolute change in class probabilities over all
+                  students in the data
+
+Cutting depth comes first because a single-row prediction walks every tree
+for ``max_depth`` steps whatever the number of trees or nodes, so depth is
+what sets its latency. The reported accuracy is measured on the other half
+of the held-out split, which played no part in the search.
+
+Agreement and probability change are measured on every student, not just
+the held-out split, so every node that training data reaches is covered
+and no subtree is collapsed just because no test student reaches it.
+
+The smaller model is written as a model artifact, and a report of size,
+latency and accuracy before and after is printed (and optionally saved).
+
+Usage:
+    python compress_model.py --max-accuracy-drop 0.01 --min-agreement 0.98
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from forest_engine import FlatForest
+from model_artifact import (ARTIFACT_PATH, ENCODERS_PATH, MODEL_PATH, REFERENCE_CSV,
+                            load_model, save_artifact)
+from model_reloader import single_row_latency
+
+OUTPUT_PATH = 'student_performance_model.compressed.spm'
+TARGET_COLUMN = 'final_grade'
+
+# Held-out split used by script_1.py
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+
+# Share of the held-out split that guides the search; the rest is only reported on
+VALIDATION_SHARE = 0.5
+
+
+class Tolerance:
+    """Limits on how far the compressed model may drift from the original"""
+
+    def __init__(self, max_accuracy_drop=0.01, min_agreement=0.98, max_proba_delta=0.02):
+        self.max_accuracy_drop = max_accuracy_drop
+        self.min_agreement = min_agreement
+        self.max_proba_delta = max_proba_delta
+
+    def allows(self, baseline, metrics):
+        return (metrics['accuracy'] >= baseline['accuracy'] - self.max_accuracy_drop
+                and metrics['agreement'] >= self.min_agreement
+                and metrics['proba_delta'] <= self.max_proba_delta)
+
+
+class _Scorer:
+    """Metrics of a forest given its per-row probabilities, accuracy over ``test_mask`` rows.
+
+    Rows are scored incrementally: ``row_state`` gives the per-row terms of
+    each metric, so a change that touches few rows is evaluated on those
+    rows only.
+    """
+
+    def __init__(self, classes, y, test_mask, original_proba):
+        self.classes = classes
+        self.y = np.asarray(y)
+        self.test_mask = test_mask
+        self.n_test = int(test_mask.sum())
+        self.original_proba = original_proba
+        self.original_labels = original_proba.argmax(axis=1)
+
+    def row_state(self, proba, rows=slice(None)):
+        labels = proba.argmax(axis=1)
+        agree = labels == self.original_labels[rows]
+        correct = (self.classes[labels] == self.y[rows]) & self.test_mask[rows]
+        delta = np.abs(proba - self.original_proba[rows]).sum(axis=1) / 2
+        return agree, correct, delta
+
+    def totals(self, agree, correct, delta):
+        return {'accuracy': float(correct.sum()) / self.n_test,
+                'agreement': float(agree.sum()) / len(agree),
+                'proba_delta': float(delta.sum()) / len(delta)}
+
+
+def node_depths(engine):
+    """``(depth, parent)`` of every node; roots have parent -1"""
+    nodes = np.arange(engine.n_nodes)
+    internal = engine.left != nodes
+    parent = np.full(engine.n_nodes, -1)
+    parent[engine.left[internal]] = nodes[internal]
+    parent[engine.right[internal]] = nodes[internal]
+    depth = np.zeros(engine.n_nodes, dtype=np.intp)
+    frontier, level = engine.roots, 0
+    while len(frontier):
+        depth[frontier] = level
+        frontier = frontier[internal[frontier]]
+        frontier = np.concatenate([engine.left[frontier], engine.right[frontier]])
+        level += 1
+    return depth, parent
+
+
+def truncate_depth(engine, leaves, scorer, tolerance, baseline):
+    """Cut every tree one level shorter at a time, while within tolerance.
+
+    ``leaves`` is the (rows, trees) output of ``engine.apply``. A row whose
+    leaf lies below the cut ends at its ancestor on the last kept level.
+    Returns ``(depth_limit, leaves)``: the largest depth still reached and
+    the leaves the rows reach under it.
+    """
+    depth, parent = node_depths(engine)
+    limit = int(depth.max())
+    while limit > 1:
+        trial = leaves.copy()
+        deeper = depth[trial] >= limit
+        while deeper.any():
+            trial[deeper] = parent[trial[deeper]]
+            deeper = depth[trial] >= limit
+        metrics = scorer.totals(*scorer.row_state(engine.value[trial].mean(axis=1)))
+        if not tolerance.allows(baseline, metrics):
+            break
+        leaves, limit = trial, limit - 1
+    return limit, leaves
+
+
+def drop_trees(tree_proba, scorer, tolerance, baseline, min_trees=1):
+    """Greedily drop the tree whose removal hurts least, while within tolerance.
+
+    ``tree_proba`` is (rows, trees, classes). Returns the kept tree indices.
+    """
+    kept = list(range(tree_proba.shape[1]))
+    total = tree_proba.sum(axis=1)
+    while len(kept) > min_trees:
+        best = None
+        for position, tree in enumerate(kept):
+            proba = (total - tree_proba[:, tree]) / (len(kept) - 1)
+            metrics = scorer.totals(*scorer.row_state(proba))
+            key = (metrics['proba_delta'], -metrics['agreement'], -metrics['accuracy'])
+            if best is None or key < best[0]:
+                best = (key, position, metrics)
+        _, position, metrics = best
+        if not tolerance.allows(baseline, metrics):
+            break
+        total -= tree_proba[:, kept.pop(position)]
+    return kept
+
+
+def cut_nodes(engine, depth_limit):
+    """Internal nodes on level ``depth_limit``, the leaves ``truncate_depth`` cut at"""
+    depth = node_depths(engine)[0]
+    return set(np.flatnonzero((depth == depth_limit)
+                              & (engine.left != np.arange(engine.n_nodes))).tolist())
+
+
+def collapse_subtrees(engine, trees, leaves, scorer, tolerance, baseline, depth_limit=None):
+    """Collapse internal nodes whose children are leaves into leaves.
+
+    ``leaves`` is the (rows, trees) leaves the rows reach; only the columns
+    in ``trees`` are used. With a ``depth_limit`` from ``truncate_depth``,
+    nodes on that level are leaves and nodes below it are gone. Candidates
+    are tried in order of least probability change, accepting each that
+    keeps the model within tolerance, and repeated until a pass accepts
+    none. Returns the set of collapsed node ids.
+    """
+    value = engine.value
+    left, right = np.array(engine.left), np.array(engine.right)
+    node_ids = np.arange(len(left))
+    is_leaf = left == node_ids
+    if depth_limit is not None:
+        # Nodes below the cut can no longer be reached; as leaves they are never candidates
+        is_leaf[node_depths(engine)[0] >= depth_limit] = True
+    collapsed = set()
+
+    current = leaves[:, trees].copy()
+    n_kept = len(trees)
+    total = value[current].sum(axis=1)
+    agree, correct, delta = scorer.row_state(total / n_kept)
+
+    tree_roots = engine.roots[trees]
+    tree_ends = np.append(engine.roots, len(left))[np.asarray(trees) + 1]
+    while True:
+        # Every node of the kept trees whose children are both leaves now
+        candidates = []
+        for column, (start, end) in enumerate(zip(tree_roots, tree_ends)):
+            for node in range(start, end):
+                if not is_leaf[node] and is_leaf[left[node]] and is_leaf[right[node]]:
+                    rows = np.flatnonzero((current[:, column] == left[node])
+                                          | (current[:, column] == right[node]))
+                    candidates.append((node, column, rows))
+
+        scored = []
+        for node, column, rows in candidates:
+            proba = (total[rows] - value[current[rows, column]] + value[node]) / n_kept
+            row_delta = scorer.row_state(proba, rows)[2]
+            scored.append((float(row_delta.sum() - delta[rows].sum()), node, column, rows))
+        scored.sort(key=lambda item: item[0])
+
+        accepted = 0
+        for _, node, column, rows in scored:
+            # Earlier acceptances in this pass may have changed these rows
+            if is_leaf[node] or not (is_leaf[left[node]] and is_leaf[right[node]]):
+                continue
+            new_total = total[rows] - value[current[rows, column]] + value[node]
+            state = scorer.row_state(new_total / n_kept, rows)
+            trial = [array.copy() for array in (agree, correct, delta)]
+            for array, rows_value in zip(trial, state):
+                array[rows] = rows_value
+            if not tolerance.allows(baseline, scorer.totals(*trial)):
+                continue
+            agree, correct, delta = trial
+            total[rows] = new_total
+            current[rows, column] = node
+            is_leaf[node] = True
+            collapsed.add(node)
+            accepted += 1
+        if not accepted:
+            return collapsed
+
+
+def rebuild(engine, trees, collapsed=()):
+    """A new FlatForest of the given trees with collapsed nodes made leaves"""
+    collapsed = set(collapsed)
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    max_depth = 0
+    for tree in trees:
+        roots.append(len(features))
+        # Depth-first renumbering of the nodes still reachable in this tree
+        stack = [(int(engine.roots[tree]), None, 0)]
+        while stack:
+            old, parent_slot, depth = stack.pop()
+            new = len(features)
+            if parent_slot is not None:
+                parent, side = parent_slot
+                (lefts if side == 0 else rights)[parent] = new
+            leaf = engine.left[old] == old or old in collapsed
+            features.append(0 if leaf else int(engine.feature[old]))
+            thresholds.append(float(engine.threshold[old]))
+            lefts.append(new)
+            rights.append(new)
+            values.append(engine.value[old])
+            if leaf:
+                max_depth = max(max_depth, depth)
+                continue
+            stack.append((int(engine.right[old]), (new, 1), depth + 1))
+            stack.append((int(engine.left[old]), (new, 0), depth + 1))
+
+    return FlatForest(
+        feature=np.asarray(features, dtype=np.intp),
+        threshold=np.asarray(thresholds, dtype=np.float64),
+        left=np.asarray(lefts, dtype=np.intp),
+        right=np.asarray(rights, dtype=np.intp),
+        value=np.asarray(values, dtype=np.float64),
+        roots=np.asarray(roots, dtype=np.intp),
+        max_depth=max_depth,
+        classes=np.array(engine.classes),
+        feature_importances=np.array(engine.feature_importances, dtype=np.float64)
+    )
+
+
+def describe(engine, encoder, X, scorer, path=None):
+    """Size, latency and accuracy figures of one model for the report.
+
+    Accuracy is over ``scorer``'s rows, the untouched test half in ``main``.
+    """
+    proba = engine.predict_proba(X)
+    engine.predict(X)
+    rounds = 20
+    started = time.perf_counter()
+    for _ in range(rounds):
+        engine.predict(X)
+    batch_seconds = (time.perf_counter() - started) / rounds
+    return dict(
+        scorer.totals(*scorer.row_state(proba)),
+        n_trees=engine.n_trees,
+        n_nodes=engine.n_nodes,
+        max_depth=engine.max_depth,
+        array_bytes=engine.nbytes,
+        file_bytes=os.path.getsize(path) if path and os.path.exists(path) else None,
+        single_row_p50_ms=single_row_latency(engine, encoder),
+        batch_rows_per_sec=len(X) / batch_seconds
+    )
+
+
+def format_report(report):
+    rows = [('n_trees', '{:d}'), ('n_nodes', '{:d}'), ('max_depth', '{:d}'),
+            ('array_bytes', '{:,d}'), ('file_bytes', '{:,d}'),
+            ('single_row_p50_ms', '{:.4f}'), ('batch_rows_per_sec', '{:,.0f}'),
+            ('accuracy', '{:.4f}'), ('agreement', '{:.4f}'), ('proba_delta', '{:.4f}')]
+    lines = ['Compression report', '==================',
+             f"{'':<22}{'before':>14}{'after':>14}"]
+    for name, fmt in rows:
+        before, after = report['before'].get(name), report['after'].get(name)
+        lines.append(f"{name:<22}"
+                     f"{fmt.format(before) if before is not None else '-':>14}"
+                     f"{fmt.format(after) if after is not None else '-':>14}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress the trained forest within an '
+                                                 'accuracy tolerance.')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH,
+                        help='Model artifact to compress (used when it exists)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--encoders', default=ENCODERS_PATH)
+    parser.add_argument('--data', default=REFERENCE_CSV,
+                        help='Training data with the final_grade column')
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                        help='Largest allowed drop in validation accuracy')
+    parser.add_argument('--min-agreement', type=float, default=0.98,
+                        help='Smallest share of unchanged predicted labels')
+    parser.add_argument('--max-proba-delta', type=float, default=0.02,
+                        help='Largest mean absolute change in class probabilities')
+    parser.add_argument('--min-trees', type=int, default=1)
+    parser.add_argument('--no-collapse', action='store_true',
+                        help='Only drop trees, keep every subtree')
+    parser.add_argument('--report', help='Also write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    from sklearn.model_selection import train_test_split
+
+    engine, encoder, version = load_model(args.artifact, args.model, args.encoders, args.data)
+    data = pd.read_csv(args.data)
+    X = encoder.encode_frame(data)
+    y = data[TARGET_COLUMN].to_numpy()
+    _, held_out = train_test_split(np.arange(len(data)), test_size=TEST_SIZE,
+                                   random_state=RANDOM_STATE, stratify=y)
+    # One half steers the search, the other is only used for the report
+    validation_rows, test_rows = train_test_split(held_out, train_size=VALIDATION_SHARE,
+                                                  random_state=RANDOM_STATE, stratify=y[held_out])
+    validation_mask = np.isin(np.arange(len(data)), validation_rows)
+    test_mask = np.isin(np.arange(len(data)), test_rows)
+
+    tolerance = Tolerance(args.max_accuracy_drop, args.min_agreement, args.max_proba_delta)
+    original_proba = engine.predict_proba(X)
+    scorer = _Scorer(engine.classes, y, validation_mask, original_proba)
+    report_scorer = _Scorer(engine.classes, y, test_mask, original_proba)
+    baseline = scorer.totals(*scorer.row_state(original_proba))
+
+    started = time.perf_counter()
+    depth_limit, leaves = truncate_depth(engine, engine.apply(X), scorer, tolerance, baseline)
+    trees = drop_trees(engine.value[leaves], scorer, tolerance, baseline, args.min_trees)
+    collapsed = cut_nodes(engine, depth_limit)
+    if not args.no_collapse:
+        collapsed |= collapse_subtrees(engine, trees, leaves, scorer, tolerance, baseline,
+                                       depth_limit)
+    compressed = rebuild(engine, trees, collapsed)
+    elapsed = time.perf_counter() - started
+
+    manifest = save_artifact(args.output, compressed, encoder, metadata={
+        'compressed_from': version,
+        'tolerance': vars(tolerance)
+    })
+    report = {
+        'source_version': version,
+        'compressed_version': manifest['model_version'],
+        'output': args.output,
+        'tolerance': vars(tolerance),
+        'depth_limit': depth_limit,
+        'collapsed_nodes': len(collapsed),
+        'search_seconds': elapsed,
+        'before': describe(engine, encoder, X, report_scorer, args.artifact),
+        'after': describe(compressed, encoder, X, report_scorer, args.output)
+    }
+    print(format_report(report))
+    print(f"Wrote {args.output} (model version {manifest['model_version']})")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
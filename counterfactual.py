@@ -0,0 +1,164 @@
+"""
+Counterfactual search: the fewest actionable changes that turn a Fail into a Pass.
+
+Only features a student can act on are changed; the rest stay fixed. The
+candidate values of each feature are pruned with the forest's split
+thresholds: values between the same two thresholds are indistinguishable to
+every tree, so only the one closest to the student's current value is kept.
+
+Candidates are searched by number of changes, one level at a time, and
+within a level in order of increasing cost. Each level is scored in large
+vectorized batches, and the search stops as soon as the cheapest
+interventions are known or the latency budget runs out.
+"""
+import time
+from itertools import combinations
+
+import numpy as np
+
+# Features a student can change; age, sex, family background and past
+# failures are held fixed
+ACTIONABLE_FEATURES = ('studytime', 'absences', 'paid', 'schoolsup', 'famsup',
+                       'activities', 'internet', 'freetime', 'goout')
+
+PASS_LABEL = 1
+
+
+class _Options:
+    """Candidate new values of one feature and the cost of each"""
+
+    __slots__ = ('feature', 'column', 'current', 'values', 'codes', 'costs')
+
+    def __init__(self, feature, column, current, values, codes, costs):
+        self.feature = feature
+        self.column = column
+        self.current = current
+        self.values = values
+        self.codes = codes
+        self.costs = costs
+
+
+def feature_options(engine, encoder, row, feature_info, feature):
+    """The values ``feature`` could be changed to, one per threshold interval.
+
+    A numerical change costs its size as a fraction of the feature's range;
+    switching a category costs 1.
+    """
+    column = encoder.columns.index(feature)
+    code = row[column]
+    lookup = encoder.lookup.get(feature)
+    if lookup is None:
+        spec = feature_info['numerical_features'][feature]
+        values = list(range(spec['min'], spec['max'] + 1))
+        codes = np.asarray(values, dtype=np.float64)
+        costs = np.abs(codes - code) / max(spec['max'] - spec['min'], 1)
+        current = int(code) if float(code).is_integer() else float(code)
+    else:
+        values = [value for value in feature_info['categorical_features'][feature]
+                  if value in lookup]
+        codes = np.asarray([lookup[value] for value in values], dtype=np.float64)
+        costs = np.ones(len(values))
+        current = encoder.classes[feature][int(code)]
+
+    # Inputs are compared as float32, like in the engine
+    thresholds = engine.split_thresholds(column)
+    intervals = np.searchsorted(thresholds, codes.astype(np.float32), side='left')
+    current_interval = np.searchsorted(thresholds, np.float32(code), side='left')
+    keep = []
+    for interval in np.unique(intervals):
+        if interval == current_interval:
+            continue
+        members = np.flatnonzero(intervals == interval)
+        keep.append(members[np.argmin(costs[members])])
+    return _Options(feature, column, current, [values[i] for i in keep],
+                    codes[keep], costs[keep])
+
+
+def search(engine, encoder, row, feature_info, features=ACTIONABLE_FEATURES, max_changes=3,
+           limit=3, budget_ms=250.0, chunk_size=4096):
+    """The ``limit`` cheapest interventions that make ``engine`` predict Pass.
+
+    Interventions with fewer changes come first, then lower cost. Returns a
+    dict with the ``interventions``, the number of ``candidates_scored``,
+    whether the search was ``complete`` within ``budget_ms`` and the
+    ``elapsed_ms``. Changes that contain a cheaper intervention found
+    earlier are not considered.
+    """
+    started = time.perf_counter()
+    deadline = started + budget_ms / 1000.0
+    options = [feature_options(engine, encoder, row, feature_info, feature)
+               for feature in features]
+    options = [option for option in options if len(option.values)]
+    pass_index = int(np.flatnonzero(engine.classes == PASS_LABEL)[0])
+
+    found = []
+    scored = 0
+    complete = True
+    for n_changes in range(1, max_changes + 1):
+        choices, costs = _level(options, n_changes, found)
+        order = np.argsort(costs, kind='stable')
+        for start in range(0, len(order), chunk_size):
+            if time.perf_counter() > deadline:
+                complete = False
+                break
+            candidates = order[start:start + chunk_size]
+            batch = choices[candidates]
+            matrix = np.repeat(row[np.newaxis, :], len(batch), axis=0)
+            for j, option in enumerate(options):
+                changed = batch[:, j] >= 0
+                matrix[changed, option.column] = option.codes[batch[changed, j]]
+            proba = engine.predict_proba(matrix)
+            scored += len(batch)
+
+            flipped = engine.classes[proba.argmax(axis=1)] == PASS_LABEL
+            for i in np.flatnonzero(flipped):
+                candidate = candidates[i]
+                found.append((n_changes, costs[candidate], choices[candidate], proba[i, pass_index]))
+            # Candidates are scored cheapest first, so the rest cannot do better
+            if len(found) >= limit:
+                break
+        if len(found) >= limit or not complete:
+            break
+
+    return {
+        'interventions': [_describe(options, *entry) for entry in found[:limit]],
+        'candidates_scored': scored,
+        'complete': complete,
+        'elapsed_ms': (time.perf_counter() - started) * 1000.0
+    }
+
+
+def _level(options, n_changes, found):
+    """Every candidate changing exactly ``n_changes`` features.
+
+    Returns ``(choices, costs)``: one row per candidate holding the index of
+    the new value of each feature, or -1 where it is unchanged, and the
+    total cost. Supersets of the interventions in ``found`` are left out.
+    """
+    blocks = []
+    for combo in combinations(range(len(options)), n_changes):
+        grids = np.meshgrid(*[np.arange(len(options[j].values)) for j in combo], indexing='ij')
+        block = np.full((grids[0].size, len(options)), -1, dtype=np.intp)
+        for j, grid in zip(combo, grids):
+            block[:, j] = grid.ravel()
+        blocks.append(block)
+    choices = np.concatenate(blocks) if blocks else np.empty((0, len(options)), dtype=np.intp)
+    for _, _, found_choices, _ in found:
+        fixed = found_choices >= 0
+        choices = choices[~(choices[:, fixed] == found_choices[fixed]).all(axis=1)]
+
+    costs = np.zeros(len(choices))
+    for j, option in enumerate(options):
+        changed = choices[:, j] >= 0
+        costs[changed] += option.costs[choices[changed, j]]
+    return choices, costs
+
+
+def _describe(options, n_changes, cost, choices, pass_probability):
+    return {
+        'changes': {option.feature: {'from': option.current, 'to': option.values[choice]}
+                    for option, choice in zip(options, choices) if choice >= 0},
+        'n_changes': n_changes,
+        'cost': float(cost),
+        'pass_probability': float(pass_probability)
+    }
@@ -0,0 +1,256 @@
+"""
+Shared feature encoding for training and serving.
+
+FeatureEncoder turns raw student records (JSON dicts or CSV rows) into the
+float feature rows the model expects, using plain dict lookups instead of
+building a DataFrame and calling LabelEncoder.transform per column.
+"""
+import csv
+import math
+import os
+from collections import Counter
+from itertools import repeat
+
+import numpy as np
+
+# Feature layout shared by training and every prediction endpoint
+CATEGORICAL_COLUMNS = ['sex', 'address', 'famsize', 'Pstatus', 'schoolsup',
+                       'famsup', 'paid', 'activities', 'internet', 'romantic']
+
+REQUIRED_COLUMNS = ['age', 'sex', 'address', 'famsize', 'Pstatus', 'Medu', 'Fedu',
+                    'studytime', 'failures', 'schoolsup', 'famsup', 'paid', 'activities',
+                    'internet', 'romantic', 'famrel', 'freetime', 'goout', 'health', 'absences']
+
+
+class FeatureEncoder:
+    """Encode student records into model feature rows.
+
+    ``classes`` maps each categorical column to its list of known values, in
+    LabelEncoder order. ``fallbacks`` maps each categorical column to the value
+    used when a record has an unseen or missing category; it defaults to the
+    first known class. Missing numerical features are encoded as 0.
+    """
+
+    def __init__(self, classes, fallbacks=None, columns=REQUIRED_COLUMNS):
+        fallbacks = fallbacks or {}
+        self.columns = list(columns)
+        self.classes = {col: list(values) for col, values in classes.items()}
+        self.n_features = len(self.columns)
+
+        # Precomputed lookup tables: value -> code, plus the fallback code
+        self.lookup = {}
+        self.fallbacks = {}
+        self.fallback_codes = {}
+        for col, values in self.classes.items():
+            self.lookup[col] = {value: float(code) for code, value in enumerate(values)}
+            fallback = fallbacks.get(col, values[0])
+            self.fallbacks[col] = fallback
+            self.fallback_codes[col] = self.lookup[col].get(fallback, 0.0)
+
+        self._plan = [(i, col, self.lookup.get(col)) for i, col in enumerate(self.columns)]
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders, fallbacks=None):
+        """Build from the dict of fitted LabelEncoders saved by training"""
+        classes = {col: [value.item() if hasattr(value, 'item') else value
+                         for value in encoder.classes_]
+                   for col, encoder in label_encoders.items()}
+        return cls(classes, fallbacks=fallbacks)
+
+    @classmethod
+    def load(cls, encoders_path='label_encoders.pkl', reference_csv=None):
+        """Load the saved encoders, taking fallbacks from a reference dataset.
+
+        When ``reference_csv`` exists, the fallback for each categorical
+        column is its most frequent value in that file.
+        """
+        import joblib
+
+        label_encoders = joblib.load(encoders_path)
+        fallbacks = None
+        if reference_csv is not None and os.path.exists(reference_csv):
+            with open(reference_csv, newline='') as f:
+                fallbacks = most_frequent_values(csv.DictReader(f), label_encoders)
+        return cls.from_label_encoders(label_encoders, fallbacks=fallbacks)
+
+    @classmethod
+    def fit(cls, data, categorical_columns=CATEGORICAL_COLUMNS):
+        """Learn classes and fallbacks from a training DataFrame"""
+        classes = {col: sorted(data[col].unique().tolist()) for col in categorical_columns}
+        fallbacks = {col: data[col].mode().iloc[0] for col in categorical_columns}
+        return cls(classes, fallbacks=fallbacks)
+
+    def to_dict(self):
+        """JSON-serializable description, stored in the model artifact"""
+        return {'columns': self.columns, 'classes': self.classes, 'fallbacks': self.fallbacks}
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec['classes'], fallbacks=spec['fallbacks'], columns=spec['columns'])
+
+    @property
+    def label_encoders(self):
+        """Equivalent fitted LabelEncoders, for saving alongside the model"""
+        from sklearn.preprocessing import LabelEncoder
+
+        encoders = {}
+        for col, values in self.classes.items():
+            encoder = LabelEncoder()
+            encoder.classes_ = np.asarray(values)
+            encoders[col] = encoder
+        return encoders
+
+    def encode(self, record, out=None):
+        """Encode one record into a float row, raising ValueError on bad values"""
+        if not isinstance(record, dict):
+            raise ValueError('Record must be a JSON object')
+        if out is None:
+            out = np.empty(self.n_features, dtype=np.float64)
+
+        for i, col, lookup in self._plan:
+            value = record.get(col)
+            if lookup is not None:
+                try:
+                    code = lookup.get(value)
+                except TypeError:
+                    code = None
+                out[i] = self.fallback_codes[col] if code is None else code
+            elif value is None or value == '':
+                out[i] = 0.0
+            else:
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    number = math.nan
+                if not math.isfinite(number):
+                    raise ValueError(f"Invalid value for '{col}'")
+                out[i] = number
+        return out
+
+    def decode(self, row):
+        """The raw record an encoded row stands for.
+
+        Unseen categories come back as the fallback they were encoded as,
+        and float32 numbers as their shortest representation.
+        """
+        record = {}
+        for i, col, lookup in self._plan:
+            if lookup is not None:
+                record[col] = self.classes[col][int(row[i])]
+            else:
+                number = float(str(np.float32(row[i])))
+                record[col] = int(number) if number.is_integer() else number
+        return record
+
+    def encode_batch(self, records):
+        """Encode many records into one matrix.
+
+        Returns the matrix of valid rows (in input order), the input positions
+        of those rows, and a {position: message} dict for rejected records.
+        """
+        matrix = np.empty((len(records), self.n_features), dtype=np.float64)
+        positions = []
+        errors = {}
+        for i, record in enumerate(records):
+            try:
+                self.encode(record, out=matrix[len(positions)])
+            except ValueError as e:
+                errors[i] = str(e)
+            else:
+                positions.append(i)
+        return matrix[:len(positions)], positions, errors
+
+    def encode_columns(self, columns, n_rows):
+        """Vectorized ``encode_batch`` over raw values stored column by column.
+
+        ``columns`` maps column names to sequences of ``n_rows`` raw values;
+        absent columns count as missing. Returns the same triple as
+        ``encode_batch``.
+        """
+        matrix = np.empty((n_rows, self.n_features), dtype=np.float64)
+        errors = {}
+        for i, col, lookup in self._plan:
+            values = columns.get(col)
+            if values is None:
+                matrix[:, i] = self.fallback_codes[col] if lookup is not None else 0.0
+            elif lookup is not None:
+                matrix[:, i] = _category_codes(values, lookup, self.fallback_codes[col])
+            else:
+                matrix[:, i] = _numbers(values)
+                for position in np.flatnonzero(~np.isfinite(matrix[:, i])):
+                    errors.setdefault(int(position), f"Invalid value for '{col}'")
+        positions = [i for i in range(n_rows) if i not in errors] if errors else list(range(n_rows))
+        return matrix[positions] if errors else matrix, positions, errors
+
+    def encode_frame(self, data):
+        """Vectorized encoding of a DataFrame of raw records.
+
+        Equivalent to ``encode`` on every row, for inputs whose numerical
+        columns are already parsed; used by the offline batch scorer.
+        """
+        matrix = np.zeros((len(data), self.n_features), dtype=np.float64)
+        for i, col, lookup in self._plan:
+            if lookup is not None:
+                if col in data:
+                    codes = data[col].map(lookup).astype(np.float64)
+                    matrix[:, i] = codes.fillna(self.fallback_codes[col]).to_numpy()
+                else:
+                    matrix[:, i] = self.fallback_codes[col]
+            elif col in data:
+                matrix[:, i] = data[col].fillna(0).to_numpy(dtype=np.float64)
+        if not np.isfinite(matrix).all():
+            raise ValueError('Non-finite numerical feature values')
+        return matrix
+
+    def transform(self, data):
+        """Encode a DataFrame of raw records (used for training)"""
+        matrix, positions, errors = self.encode_batch(data.to_dict('records'))
+        if errors:
+            position, message = next(iter(errors.items()))
+            raise ValueError(f'Row {position}: {message}')
+        return matrix
+
+
+def _category_codes(values, lookup, fallback_code):
+    try:
+        return np.fromiter(map(lookup.get, values, repeat(fallback_code)),
+                           dtype=np.float64, count=len(values))
+    except TypeError:
+        # Unhashable values, e.g. JSON lists, fall back like unseen categories
+        codes = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                codes[i] = lookup.get(value, fallback_code)
+            except TypeError:
+                codes[i] = fallback_code
+        return codes
+
+
+def _numbers(values):
+    """Floats of raw numerical values as ``encode`` reads them; NaN where invalid"""
+    try:
+        numbers = np.asarray(values, dtype=np.float64)
+        if numbers.ndim == 1 and np.isfinite(numbers).all():
+            return numbers
+    except (TypeError, ValueError):
+        pass
+    # Blanks, missing values and invalid entries, one value at a time
+    numbers = np.empty(len(values), dtype=np.float64)
+    for i, value in enumerate(values):
+        if value is None or value == '':
+            numbers[i] = 0.0
+            continue
+        try:
+            numbers[i] = float(value)
+        except (TypeError, ValueError):
+            numbers[i] = math.nan
+    return numbers
+
+
+def most_frequent_values(rows, columns):
+    """Most frequent value of each of ``columns`` over an iterable of dict rows"""
+    counts = {col: Counter() for col in columns}
+    for row in rows:
+        for col, counter in counts.items():
+            counter[row.get(col)] += 1
+    return {col: counter.most_common(1)[0][0] for col, counter in counts.items() if counter}
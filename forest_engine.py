@@ -0,0 +1,552 @@
+"""
+Flat-array inference engine for the Random Forest model.
+
+The pickled RandomForestClassifier is converted once into contiguous NumPy
+node arrays. Prediction then walks every tree at the same time with a few
+vectorized array operations per tree level, which avoids sklearn's
+per-call input validation and its dispatch over the individual estimators.
+Probabilities are bit-identical to RandomForestClassifier.predict_proba.
+
+Batches are not walked at all: each tree's leaves are numbered left to right
+and, for every interval between a feature's split thresholds, a bitmask
+records which leaves remain reachable. A row's masks from all features are
+ANDed, and in each tree the first remaining leaf is the one it reaches
+(the QuickScorer method). Features with few thresholds share one table
+indexed by their combined interval, so a row needs a handful of lookups.
+"""
+import numpy as np
+
+# Batches of at least this many rows use the leaf bitmasks instead of a walk
+MASK_MIN_ROWS = 16
+
+# Most interval combinations in one bitmask table, and most bytes held by
+# all tables; forests whose tables would exceed it are always walked
+MASK_GROUP_STATES = 1024
+MASK_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+class FlatForest:
+    """A random forest stored as flat node arrays.
+
+    All trees share one set of arrays; ``roots[t]`` is the index of the
+    first node of tree ``t``. Leaves point to themselves on both sides, so
+    a traversal can run for ``max_depth`` steps without special-casing them.
+    """
+
+    # Arrays that fully describe a forest, in serialization order
+    ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'value', 'roots',
+                   'classes', 'feature_importances')
+    WALK_ARRAY_NAMES = ('walk_feature', 'walk_threshold', 'walk_child', 'walk_roots')
+
+    def __init__(self, feature, threshold, left, right, value, roots,
+                 max_depth, classes, feature_importances, walk=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes = classes
+        self.feature_importances = feature_importances
+        self.n_trees = len(roots)
+        self.n_features = len(feature_importances)
+
+        # Traversal layout: node i is addressed as 2*i so the next node is
+        # found with a single lookup, _walk_child[2*i + goes_right].
+        # It can be passed in precomputed, e.g. from a memory-mapped artifact.
+        if walk is None:
+            walk = {
+                'walk_feature': np.repeat(feature, 2),
+                'walk_threshold': np.repeat(threshold, 2),
+                'walk_child': (2 * np.stack([left, right], axis=1)).ravel(),
+                'walk_roots': 2 * roots
+            }
+        self._walk_feature = walk['walk_feature']
+        self._walk_threshold = walk['walk_threshold']
+        self._walk_child = walk['walk_child']
+        self._walk_roots = walk['walk_roots']
+        self._edge_delta_cache = None
+        self._leaf_bounds_cache = None
+        self._leaf_masks_cache = None
+
+    def to_arrays(self):
+        """All arrays of the forest, including the traversal layout"""
+        arrays = {name: getattr(self, name) for name in self.ARRAY_NAMES}
+        arrays.update({name: getattr(self, '_' + name) for name in self.WALK_ARRAY_NAMES})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, max_depth):
+        """Rebuild a forest from the output of ``to_arrays``"""
+        walk = None
+        if all(name in arrays for name in cls.WALK_ARRAY_NAMES):
+            walk = {name: arrays[name] for name in cls.WALK_ARRAY_NAMES}
+        return cls(max_depth=max_depth, walk=walk,
+                   **{name: arrays[name] for name in cls.ARRAY_NAMES})
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Build a FlatForest from a fitted RandomForestClassifier.
+
+        A single fitted DecisionTreeClassifier becomes a one-tree forest.
+        """
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for estimator in getattr(model, 'estimators_', [model]):
+            tree = estimator.tree_
+            n = tree.node_count
+            node_ids = np.arange(offset, offset + n, dtype=np.intp)
+            is_leaf = tree.children_left == -1
+
+            left = np.where(is_leaf, node_ids, tree.children_left + offset)
+            right = np.where(is_leaf, node_ids, tree.children_right + offset)
+            feature = np.where(is_leaf, 0, tree.feature)
+
+            # Class distributions as DecisionTreeClassifier.predict_proba
+            # returns them: sklearn >= 1.4 stores fractions and returns them
+            # as they are, older versions store counts and normalize them
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            if not np.allclose(normalizer, 1.0):
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer
+
+            features.append(feature)
+            thresholds.append(tree.threshold)
+            lefts.append(left)
+            rights.append(right)
+            values.append(value)
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.intp),
+            right=np.ascontiguousarray(np.concatenate(rights), dtype=np.intp),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max_depth,
+            classes=np.asarray(model.classes_),
+            feature_importances=np.asarray(model.feature_importances_, dtype=np.float64),
+        )
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the forest's arrays, whether owned or memory-mapped"""
+        return sum(array.nbytes for array in self.to_arrays().values())
+
+    @property
+    def cache_nbytes(self):
+        """Bytes held by the lookup tables built on first use (see ``warm``)"""
+        arrays = []
+        if self._edge_delta_cache is not None:
+            arrays.append(self._edge_delta_cache)
+        if self._leaf_bounds_cache is not None:
+            arrays.extend(self._leaf_bounds_cache)
+        if self._leaf_masks_cache:
+            thresholds, tables, _, leaf_nodes = self._leaf_masks_cache
+            arrays.extend(thresholds)
+            arrays.extend(table for _, _, table in tables)
+            arrays.append(leaf_nodes)
+        return sum(array.nbytes for array in arrays)
+
+    def warm(self):
+        """Build every lookup table now rather than on first use; returns ``self``"""
+        self._edge_delta()
+        self._leaf_bounds()
+        self._leaf_masks()
+        return self
+
+    def split_thresholds(self, feature):
+        """Sorted distinct thresholds of every split on ``feature``.
+
+        Inputs falling between the same two thresholds reach the same leaf
+        in every tree, so the forest cannot tell them apart.
+        """
+        internal = self.left != np.arange(self.n_nodes)
+        return np.unique(self.threshold[internal & (self.feature == feature)])
+
+    def _check(self, X):
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        if X.shape[1] != self.n_features:
+            raise ValueError(f'Expected {self.n_features} features, got {X.shape[1]}')
+        return X
+
+    def _walk(self, X, walk_roots):
+        """Leaf reached from each of ``walk_roots``, shape (n_rows, len(walk_roots))"""
+        n_rows = X.shape[0]
+        flat_x = X.ravel()
+        if n_rows == 1:
+            # Single-row fast path: take() on a short 1-D vector of node ids
+            # has the lowest per-call overhead
+            nodes = walk_roots
+            for _ in range(self.max_depth):
+                goes_right = (flat_x.take(self._walk_feature.take(nodes))
+                              > self._walk_threshold.take(nodes))
+                nodes = self._walk_child.take(nodes + goes_right)
+        else:
+            # Batches: intp fancy indexing is much faster than take() on
+            # large index arrays
+            nodes = np.repeat(walk_roots[np.newaxis, :], n_rows, axis=0)
+            row_offsets = (np.arange(n_rows) * self.n_features)[:, np.newaxis]
+            for _ in range(self.max_depth):
+                goes_right = (flat_x[self._walk_feature[nodes] + row_offsets]
+                              > self._walk_threshold[nodes])
+                nodes = self._walk_child[nodes + goes_right]
+        return (nodes >> 1).reshape(n_rows, len(walk_roots))
+
+    def _leaf_masks(self):
+        """Bitmask tables of the reachable leaves; built on first use.
+
+        Returns ``(thresholds, groups, n_words, leaf_nodes)``, or False when
+        the tables would exceed MASK_BUDGET_BYTES. ``thresholds[f]`` are the
+        sorted split thresholds of feature ``f``; a value's interval is the
+        number of them it exceeds. Each group is ``(features, strides,
+        table)``: ``table[sum(interval * stride)]`` holds ``n_words`` uint64
+        words per tree, with bit ``j`` set when leaf ``j`` of the tree (left
+        to right) is still reachable. ``leaf_nodes[t, j]`` is that leaf's node.
+        """
+        if self._leaf_masks_cache is None:
+            self._leaf_masks_cache = self._build_leaf_masks()
+        return self._leaf_masks_cache
+
+    def _build_leaf_masks(self):
+        nodes = np.arange(self.n_nodes)
+        is_leaf = self.left == nodes
+        tree_of = np.repeat(np.arange(self.n_trees), np.diff(np.append(self.roots, self.n_nodes)))
+
+        # Internal nodes by depth, then leaf counts bottom-up and each
+        # subtree's first leaf top-down, giving left-to-right leaf numbers
+        levels = []
+        frontier = self.roots
+        while len(frontier):
+            internal = frontier[~is_leaf[frontier]]
+            levels.append(internal)
+            frontier = np.concatenate([self.left[internal], self.right[internal]])
+        n_leaves = is_leaf.astype(np.int64)
+        for level in reversed(levels):
+            n_leaves[level] = n_leaves[self.left[level]] + n_leaves[self.right[level]]
+        first = np.zeros(self.n_nodes, dtype=np.int64)
+        for level in levels:
+            first[self.left[level]] = first[level]
+            first[self.right[level]] = first[level] + n_leaves[self.left[level]]
+
+        n_words = int(n_leaves[self.roots].max() + 63) // 64
+        word_bits = 64 * np.arange(n_words)
+
+        def bits_below(k):
+            """Per word, the mask of leaf numbers below ``k``, shape (len(k), n_words)"""
+            k = np.clip(k[:, np.newaxis] - word_bits, 0, 64).astype(np.uint64)
+            partial = (np.uint64(1) << np.minimum(k, np.uint64(63))) - np.uint64(1)
+            return np.where(k == 64, ~np.uint64(0), partial)
+
+        reachable = bits_below(n_leaves[self.roots])
+        leaf_nodes = np.zeros((self.n_trees, 64 * n_words), dtype=np.intp)
+        leaf_nodes[tree_of[is_leaf], first[is_leaf]] = nodes[is_leaf]
+
+        # Per feature and interval: the leaves still reachable once every
+        # split whose threshold the value exceeds has sent it right, i.e.
+        # has ruled out the leaves of its left subtree
+        internal = nodes[~is_leaf]
+        left = self.left[internal]
+        ruled_out = ~(bits_below(first[left] + n_leaves[left]) & ~bits_below(first[left]))
+        thresholds, cumulative = [], []
+        for f in range(self.n_features):
+            split = self.feature[internal] == f
+            values = np.unique(self.threshold[internal[split]])
+            masks = np.repeat(reachable[np.newaxis], len(values) + 1, axis=0)
+            interval = np.searchsorted(values, self.threshold[internal[split]]) + 1
+            np.bitwise_and.at(masks, (interval, tree_of[internal[split]]), ruled_out[split])
+            thresholds.append(values)
+            cumulative.append(np.bitwise_and.accumulate(masks, axis=0))
+
+        # Features with the fewest intervals first, packed into shared tables
+        groups = []
+        for f in sorted(range(self.n_features), key=lambda f: len(thresholds[f])):
+            states = len(thresholds[f]) + 1
+            if groups and groups[-1][1] * states <= MASK_GROUP_STATES:
+                groups[-1][0].append(f)
+                groups[-1][1] *= states
+            else:
+                groups.append([[f], states])
+        row_bytes = self.n_trees * n_words * 8
+        if sum(n_states for _, n_states in groups) * row_bytes > MASK_BUDGET_BYTES:
+            return False
+
+        tables = []
+        for features, _ in groups:
+            table = cumulative[features[0]]
+            strides = [1]
+            for f in features[1:]:
+                table = (table[:, np.newaxis] & cumulative[f][np.newaxis]).reshape(
+                    -1, self.n_trees, n_words)
+                strides = [stride * (len(thresholds[f]) + 1) for stride in strides] + [1]
+            tables.append((features, strides, table.reshape(len(table), -1)))
+        return thresholds, tables, n_words, leaf_nodes
+
+    def _leaves(self, X, start=0, end=None):
+        """Leaf reached in each of trees ``start:end``, shape (n_rows, end - start)"""
+        end = self.n_trees if end is None else end
+        masks = self._leaf_masks() if X.shape[0] >= MASK_MIN_ROWS else False
+        # NaN goes left at every split, which intervals cannot express
+        if not masks or np.isnan(X).any():
+            return self._walk(X, self._walk_roots[start:end])
+
+        thresholds, tables, n_words, leaf_nodes = masks
+        n_rows = X.shape[0]
+        columns = slice(start * n_words, end * n_words)
+        reachable = None
+        for features, strides, table in tables:
+            index = np.zeros(n_rows, dtype=np.intp)
+            for f, stride in zip(features, strides):
+                # sklearn compares float32 inputs against float64 thresholds
+                index += np.searchsorted(thresholds[f], X[:, f].astype(np.float64)) * stride
+            if reachable is None:
+                reachable = table[index, columns]
+            else:
+                np.bitwise_and(reachable, table[index, columns], out=reachable)
+
+        # First remaining leaf per tree: the lowest set bit of the first non-zero word
+        reachable = reachable.reshape(n_rows, end - start, n_words)
+        word = reachable[:, :, n_words - 1]
+        word_index = np.full(word.shape, n_words - 1, dtype=np.intp)
+        for w in range(n_words - 2, -1, -1):
+            nonzero = reachable[:, :, w] != 0
+            word = np.where(nonzero, reachable[:, :, w], word)
+            word_index[nonzero] = w
+        lowest = (word & (~word + np.uint64(1))).astype(np.float64)
+        bit = (lowest.view(np.int64) >> 52) - 1023
+        return leaf_nodes[np.arange(start, end), word_index * 64 + bit]
+
+    def apply(self, X):
+        """Return the global leaf index reached in every tree, shape (n_rows, n_trees)"""
+        return self._leaves(self._check(X))
+
+    def predict_proba(self, X, chunk_size=1024):
+        """Class probabilities, identical to RandomForestClassifier.predict_proba"""
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        # Large inputs are walked in cache-sized chunks of (rows, trees) buffers
+        if X.shape[0] > chunk_size:
+            return np.concatenate([self.predict_proba(X[start:start + chunk_size])
+                                   for start in range(0, X.shape[0], chunk_size)])
+
+        leaves = self.apply(X)
+        # Sum trees in estimator order, then average, as sklearn does
+        proba = self.value.take(leaves.T, axis=0).sum(axis=0)
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        """Return (labels, probabilities) from a single traversal"""
+        proba = self.predict_proba(X)
+        return self.classes[proba.argmax(axis=1)], proba
+
+    def _edge_delta(self):
+        """Change in class distribution along each edge, per class.
+
+        Laid out like ``_walk_child``: ``[c, 2*i + goes_right]`` is the
+        change for class ``c`` when moving from node ``i`` to that child.
+        Built on first use; zero for the self-loops of leaves.
+        """
+        if self._edge_delta_cache is None:
+            children = self._walk_child >> 1
+            parents = np.arange(len(children)) >> 1
+            self._edge_delta_cache = np.ascontiguousarray((self.value[children]
+                                                           - self.value[parents]).T)
+        return self._edge_delta_cache
+
+    def _leaf_bounds(self):
+        """Smallest and largest leaf value of each tree, per class; built on first use"""
+        if self._leaf_bounds_cache is None:
+            is_leaf = (self.left == np.arange(self.n_nodes))[:, np.newaxis]
+            low = np.minimum.reduceat(np.where(is_leaf, self.value, np.inf), self.roots)
+            high = np.maximum.reduceat(np.where(is_leaf, self.value, -np.inf), self.roots)
+            self._leaf_bounds_cache = (low, high)
+        return self._leaf_bounds_cache
+
+    def predict_early_exit(self, X, block_size=10, delta=None):
+        """Return (labels, trees_evaluated), stopping each row once its vote is decided.
+
+        Trees are evaluated in estimator order, ``block_size`` at a time. A
+        row stops as soon as even the most extreme leaves of the remaining
+        trees could not change its winning class, so its label always
+        equals ``predict``. With ``delta``, a row also stops once a
+        Hoeffding bound says the vote is decided with probability at least
+        ``1 - delta``, treating the trees as random draws; such labels can
+        differ from ``predict``.
+        """
+        X = self._check(X)
+        n_rows = X.shape[0]
+        low, high = self._leaf_bounds()
+        # Bounds on what the trees from index k onwards can still add
+        remaining_low = np.vstack([np.cumsum(low[::-1], axis=0)[::-1], np.zeros(low.shape[1])])
+        remaining_high = np.vstack([np.cumsum(high[::-1], axis=0)[::-1], np.zeros(high.shape[1])])
+
+        totals = np.zeros((n_rows, self.value.shape[1]))
+        evaluated = np.zeros(n_rows, dtype=np.intp)
+        active = np.arange(n_rows)
+        for start in range(0, self.n_trees, block_size):
+            end = min(start + block_size, self.n_trees)
+            leaves = self._leaves(X[active], start, end)
+            totals[active] += self.value[leaves].sum(axis=1)
+            evaluated[active] = end
+            if end == self.n_trees:
+                break
+
+            current = totals[active]
+            rows = np.arange(len(active))
+            best = current.argmax(axis=1)
+            worst_case = current[rows, best] + remaining_low[end][best]
+            rivals = current + remaining_high[end]
+            rivals[rows, best] = -np.inf
+            # The margin keeps rounding in the block sums from deciding a near-tie
+            decided = worst_case > rivals.max(axis=1) + 1e-9
+            if delta is not None:
+                mean = current / end
+                ranked = np.sort(mean, axis=1)
+                bound = np.sqrt(np.log(2 / delta) / (2 * end))
+                decided |= ranked[:, -1] - ranked[:, -2] >= 2 * bound
+            active = active[~decided]
+            if not len(active):
+                break
+        return self.classes[totals.argmax(axis=1)], evaluated
+
+    def proba_at_most(self, X, limit, class_index, block_size=10):
+        """Rows whose probability of class ``class_index`` may be at most ``limit``.
+
+        Trees are evaluated in estimator order, ``block_size`` at a time,
+        and a row is dropped as soon as even the smallest leaves of the
+        remaining trees would take it above ``limit``. Returns ``(rows,
+        proba, trees_evaluated)``: the positions of the rows kept, their
+        probabilities, identical to ``predict_proba``, and the total number
+        of trees evaluated over all rows.
+        """
+        X = self._check(X)
+        low, _ = self._leaf_bounds()
+        remaining_low = np.append(np.cumsum(low[::-1, class_index])[::-1], 0.0)
+        # Compared as sums over trees; the margin keeps rounding from dropping a tie
+        bound = limit * self.n_trees + 1e-9
+
+        totals = np.zeros((X.shape[0], self.value.shape[1]))
+        active = np.arange(X.shape[0])
+        evaluated = 0
+        for start in range(0, self.n_trees, block_size):
+            end = min(start + block_size, self.n_trees)
+            leaves = self._leaves(X[active], start, end)
+            current = totals[active]
+            # One tree at a time, so the sums round exactly as predict_proba's
+            for t in range(end - start):
+                current += self.value[leaves[:, t]]
+            totals[active] = current
+            evaluated += len(active) * (end - start)
+            if end < self.n_trees:
+                active = active[current[:, class_index] + remaining_low[end] <= bound]
+            if not len(active):
+                break
+        return active, totals[active] / self.n_trees, evaluated
+
+    def trace(self, x, trees=None):
+        """Per-tree decision paths of one row, for the trees ``trees`` (all by default).
+
+        Returns a ``(trees, max_depth)`` int32 array of the walk-layout edges
+        each path takes; a leaf reached early loops back to itself for the
+        remaining depths. The edges are all a caller needs to keep: the leaf,
+        the features tested and the contributions follow from them through
+        ``path_leaves``, ``path_tests`` and ``path_contributions``. A tree
+        whose path tests none of the features that change reaches the same
+        leaf, so callers can re-trace only the other trees.
+        """
+        x = self._check(x)
+        if x.shape[0] != 1:
+            raise ValueError('trace expects a single row')
+        x = x[0]
+        nodes = self._walk_roots if trees is None else self._walk_roots[trees]
+        edges = np.empty((len(nodes), self.max_depth), dtype=np.int32)
+        for depth in range(self.max_depth):
+            edges[:, depth] = nodes + (x.take(self._walk_feature.take(nodes))
+                                       > self._walk_threshold.take(nodes))
+            nodes = self._walk_child.take(edges[:, depth])
+        return edges
+
+    def path_leaves(self, edges):
+        """Leaf reached by each path of ``trace``"""
+        return self._walk_child.take(edges[:, -1]) >> 1
+
+    def path_tests(self, edges, features):
+        """Whether each path of ``trace`` splits on any of the feature indices ``features``"""
+        # Leaves loop back to themselves and test nothing
+        moved = self._walk_child.take(edges) != (edges & ~1)
+        return (moved & np.isin(self._walk_feature.take(edges), features)).any(axis=1)
+
+    def path_contributions(self, edges):
+        """``(features, classes)`` contributions of the paths of ``trace`` over all trees.
+
+        Summed depth by depth in the order ``explain`` uses, so a full trace
+        gives exactly the contributions ``explain`` returns for the row.
+        """
+        edge_delta = self._edge_delta()
+        contributions = np.zeros((len(edge_delta), self.n_features))
+        for depth in range(edges.shape[1]):
+            step = edges[:, depth]
+            features = self._walk_feature.take(step)
+            for c, delta in enumerate(edge_delta):
+                contributions[c] += np.bincount(features, weights=delta.take(step),
+                                                minlength=self.n_features)
+        contributions /= self.n_trees
+        return contributions.T
+
+    @property
+    def bias(self):
+        """Mean class distribution at the roots: the prediction before any split"""
+        return self.value[self.roots].mean(axis=0)
+
+    def explain(self, X, chunk_size=1024):
+        """Return (labels, probabilities, contributions) from a single traversal.
+
+        ``contributions[r, f]`` is the change in class probabilities that
+        splits on feature ``f`` made along the decision paths of row ``r``,
+        averaged over the trees (Saabas decomposition), so that ``bias +
+        contributions[r].sum(axis=0)`` equals the row's probabilities up to
+        rounding. Probabilities themselves match ``predict_proba`` exactly.
+        """
+        X = self._check(X)
+        if X.shape[0] > chunk_size:
+            parts = [self.explain(X[start:start + chunk_size])
+                     for start in range(0, X.shape[0], chunk_size)]
+            return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+        n_rows = X.shape[0]
+        n_classes = self.value.shape[1]
+        flat_x = X.ravel()
+        row_offsets = (np.arange(n_rows) * self.n_features)[:, np.newaxis]
+        contributions = np.zeros((n_classes, n_rows * self.n_features))
+        edge_delta = self._edge_delta()
+        nodes = np.repeat(self._walk_roots[np.newaxis, :], n_rows, axis=0)
+        for _ in range(self.max_depth):
+            slots = self._walk_feature[nodes] + row_offsets
+            edges = nodes + (flat_x[slots] > self._walk_threshold[nodes])
+            slots = slots.ravel()
+            for c in range(n_classes):
+                contributions[c] += np.bincount(slots, weights=edge_delta[c][edges].ravel(),
+                                                minlength=contributions.shape[1])
+            nodes = self._walk_child[edges]
+
+        leaves = (nodes >> 1).reshape(n_rows, self.n_trees)
+        proba = self.value.take(leaves.T, axis=0).sum(axis=0)
+        proba /= self.n_trees
+        contributions /= self.n_trees
+        contributions = contributions.reshape(n_classes, n_rows, self.n_features).transpose(1, 2, 0)
+        return self.classes[proba.argmax(axis=1)], proba, contributions
@@ -0,0 +1,214 @@
+"""
+Low-overhead request metrics with Prometheus text exposition.
+
+Every thread records into its own shard of counters and histograms, so the
+hot path never takes a lock. Shards are summed only when /metrics is
+scraped, and the shard of a finished thread is folded into a retired total
+so short-lived request threads do not leak memory.
+"""
+import bisect
+import threading
+import time
+import weakref
+
+# Latency buckets in seconds, from 50 microseconds to 2.5 seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Fixed-bucket histogram written by a single thread.
+
+    ``counts[i]`` holds values in ``(bounds[i-1], bounds[i]]``; the last slot
+    holds values above every bound.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.total += other.total
+        self.count += other.count
+
+    def snapshot(self):
+        buckets = [{'le': bound, 'count': n} for bound, n in zip(self.bounds, self.counts)]
+        buckets.append({'le': '+Inf', 'count': self.counts[-1]})
+        return {
+            'buckets': buckets,
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.0
+        }
+
+
+class _Shard:
+    """Metrics recorded by one thread"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class _Metric:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.key = (name, tuple(sorted(labels.items())))
+
+
+class Counter(_Metric):
+    def inc(self, amount=1):
+        counters = self.registry._shard().counters
+        counters[self.key] = counters.get(self.key, 0) + amount
+
+    def value(self):
+        """Total over all threads; sums every shard, so keep it off the hot path"""
+        return self.registry.collect().counters.get(self.key, 0)
+
+
+class HistogramMetric(_Metric):
+    def __init__(self, registry, name, labels, bounds):
+        super().__init__(registry, name, labels)
+        self.bounds = bounds
+
+    def observe(self, value):
+        histograms = self.registry._shard().histograms
+        histogram = histograms.get(self.key)
+        if histogram is None:
+            histogram = histograms[self.key] = Histogram(self.bounds)
+        histogram.observe(value)
+
+
+class MetricsRegistry:
+    """Per-thread sharded counters and histograms"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.help = {}
+        self._local = threading.local()
+        self._shards = set()
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text='', **labels):
+        self.help.setdefault(name, (help_text, 'counter'))
+        return Counter(self, name, labels)
+
+    def histogram(self, name, help_text='', bounds=LATENCY_BUCKETS, **labels):
+        self.help.setdefault(name, (help_text, 'histogram'))
+        return HistogramMetric(self, name, labels, bounds)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # Only taken once per thread, never on the recording path
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.add(shard)
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards.discard(shard)
+            self._merge_into(self._retired, shard)
+
+    @staticmethod
+    def _merge_into(target, shard):
+        for key, value in list(shard.counters.items()):
+            target.counters[key] = target.counters.get(key, 0) + value
+        for key, histogram in list(shard.histograms.items()):
+            merged = target.histograms.get(key)
+            if merged is None:
+                merged = target.histograms[key] = Histogram(histogram.bounds)
+            merged.merge(histogram)
+
+    def collect(self):
+        """Sum all shards into one _Shard"""
+        total = _Shard()
+        with self._lock:
+            self._merge_into(total, self._retired)
+            for shard in list(self._shards):
+                self._merge_into(total, shard)
+        return total
+
+    def render(self, extra=()):
+        """Prometheus text exposition of every metric.
+
+        ``extra`` is an iterable of ``(name, type, help, [(labels, value)])``
+        for values owned by other components, e.g. cache counters.
+        """
+        total = self.collect()
+        families = {}
+        for (name, labels), value in total.counters.items():
+            families.setdefault(name, []).append((labels, value))
+        for (name, labels), histogram in total.histograms.items():
+            families.setdefault(name, []).append((labels, histogram))
+
+        lines = []
+        for name in sorted(families):
+            help_text, metric_type = self.help.get(name, ('', 'untyped'))
+            full_name = self.prefix + name
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for labels, value in sorted(families[name], key=lambda item: item[0]):
+                if metric_type == 'histogram':
+                    lines.extend(_render_histogram(full_name, labels, value))
+                else:
+                    lines.append(f'{full_name}{_labels(labels)} {value}')
+        for name, metric_type, help_text, samples in extra:
+            full_name = self.prefix + name
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{full_name}{_labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class Stopwatch:
+    """Time consecutive stages of one request into per-stage histograms.
+
+    With ``record=True`` the lap times are also kept in ``laps`` (in ms),
+    e.g. to return them in a profiled response.
+    """
+
+    def __init__(self, stages, record=False):
+        self.stages = stages
+        self.started = self.last = time.perf_counter()
+        self.laps = {} if record else None
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage].observe(now - self.last)
+        if self.laps is not None:
+            self.laps[stage] = (now - self.last) * 1000.0
+        self.last = now
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000.0
+
+
+def _labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+def _render_histogram(name, labels, histogram):
+    cumulative = 0
+    for bound, n in zip(histogram.bounds, histogram.counts):
+        cumulative += n
+        yield f'{name}_bucket{_labels(labels, ("le", repr(float(bound))))} {cumulative}'
+    yield f'{name}_bucket{_labels(labels, ("le", "+Inf"))} {histogram.count}'
+    yield f'{name}_sum{_labels(labels)} {histogram.total}'
+    yield f'{name}_count{_labels(labels)} {histogram.count}'
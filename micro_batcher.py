@@ -0,0 +1,104 @@
+"""
+Micro-batching for concurrent single-row predictions.
+
+Requests that arrive within a short window are stacked into one matrix and
+scored with a single model call, and each caller gets back its own row.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import Histogram
+
+
+class MicroBatcher:
+    """Collect concurrent single-row requests into batched model calls.
+
+    ``predict_fn`` takes a 2-D feature matrix and returns a tuple of arrays
+    with one entry per row, e.g. ``(labels, probas)``; each caller gets the
+    tuple of its own row's entries.
+    A batch is dispatched once it holds ``max_batch_size`` rows or
+    ``window_ms`` milliseconds after its first row arrived.
+    """
+
+    WAIT_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100]
+    SIZE_BOUNDS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+    def __init__(self, predict_fn, window_ms=2.0, max_batch_size=64):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+        self.predict_fn = predict_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = int(max_batch_size)
+        self.queue_wait_ms = Histogram(self.WAIT_BOUNDS_MS)
+        self.batch_size = Histogram(self.SIZE_BOUNDS)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, row, predict_fn=None):
+        """Queue one feature row and return a Future of its row of results.
+
+        ``predict_fn`` overrides the batcher's model for this row, e.g. to
+        pin the model a request started with while a new one is swapped in.
+        """
+        future = Future()
+        self._queue.put((np.asarray(row, dtype=np.float64), time.perf_counter(), future,
+                         predict_fn or self.predict_fn))
+        return future
+
+    def predict(self, row, timeout=None, predict_fn=None):
+        """Score one feature row through the batcher, blocking until done"""
+        return self.submit(row, predict_fn).result(timeout)
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000.0,
+            'max_batch_size': self.max_batch_size,
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+            'batch_size': self.batch_size.snapshot()
+        }
+
+    def _collect(self):
+        """Block for the first request, then gather more until the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            # Stats are only written from this thread, so no lock is needed
+            for _, enqueued, _, _ in batch:
+                self.queue_wait_ms.observe((started - enqueued) * 1000.0)
+            self.batch_size.observe(len(batch))
+
+            # Rows are grouped by model; only a model swap makes more than one group
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[3], []).append(item)
+            for predict_fn, items in groups.items():
+                self._score(predict_fn, items)
+
+    @staticmethod
+    def _score(predict_fn, items):
+        try:
+            outputs = predict_fn(np.stack([row for row, _, _, _ in items]))
+        except Exception as e:
+            for _, _, future, _ in items:
+                future.set_exception(e)
+            return
+        for i, (_, _, future, _) in enumerate(items):
+            future.set_result(tuple(output[i] for output in outputs))
@@ -0,0 +1,155 @@
+"""
+Memory-mappable model artifact.
+
+The forest's node arrays, the encoder tables and a small JSON manifest are
+written to a single versioned binary file:
+
+    magic (8 bytes) | format version (uint32) | manifest length (uint32)
+    | manifest JSON | arrays, each aligned to 64 bytes
+
+Loading maps the file read-only and exposes every array as a zero-copy view,
+so startup does no unpickling and all worker processes on a host share one
+set of physical pages.
+
+Usage:
+    python model_artifact.py [model.pkl] [label_encoders.pkl] [output.spm]
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from feature_encoder import FeatureEncoder
+from forest_engine import FlatForest
+
+MAGIC = b'SPPMODEL'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+HEADER = struct.Struct('<8sII')
+
+ARTIFACT_PATH = 'student_performance_model.spm'
+MODEL_PATH = 'student_performance_model.pkl'
+ENCODERS_PATH = 'label_encoders.pkl'
+REFERENCE_CSV = 'student_data.csv'
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def forest_version(engine):
+    """Content hash of a forest's node arrays"""
+    digest = hashlib.sha256()
+    for name, array in engine.to_arrays().items():
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:12]
+
+
+def save_artifact(path, engine, encoder, metadata=None):
+    """Write a forest and its encoder to ``path``; returns the manifest"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in engine.to_arrays().items()}
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_version': forest_version(engine),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'n_trees': engine.n_trees,
+        'n_nodes': engine.n_nodes,
+        'max_depth': engine.max_depth,
+        'encoder': encoder.to_dict(),
+        'metadata': metadata or {},
+        'arrays': layout
+    }
+    manifest_bytes = json.dumps(manifest).encode('utf-8')
+    data_start = _aligned(HEADER.size + len(manifest_bytes))
+
+    # Write to a temporary file and rename, so readers never see a partial file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(manifest_bytes)))
+        f.write(manifest_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def _read_header(f):
+    magic, version, manifest_length = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f'{f.name} is not a model artifact')
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Unsupported artifact format version {version} '
+                         f'(expected {FORMAT_VERSION})')
+    manifest = json.loads(f.read(manifest_length).decode('utf-8'))
+    return manifest, _aligned(HEADER.size + manifest_length)
+
+
+def read_manifest(path):
+    """Read only the manifest of an artifact"""
+    with open(path, 'rb') as f:
+        return _read_header(f)[0]
+
+
+def load_artifact(path):
+    """Memory-map an artifact; returns (engine, encoder, manifest)"""
+    with open(path, 'rb') as f:
+        manifest, data_start = _read_header(f)
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for name, spec in manifest['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=data_start + spec['offset']).reshape(spec['shape'])
+
+    engine = FlatForest.from_arrays(arrays, max_depth=manifest['max_depth'])
+    encoder = FeatureEncoder.from_dict(manifest['encoder'])
+    return engine, encoder, manifest
+
+
+def load_model(artifact_path=ARTIFACT_PATH, model_path=MODEL_PATH,
+               encoders_path=ENCODERS_PATH, reference_csv=REFERENCE_CSV):
+    """Load (engine, encoder, model_version), preferring the mapped artifact.
+
+    Falls back to the pickled model and encoders when no artifact exists.
+    """
+    if artifact_path and os.path.exists(artifact_path):
+        engine, encoder, manifest = load_artifact(artifact_path)
+        return engine, encoder, manifest['model_version']
+
+    import joblib
+
+    engine = FlatForest.from_sklearn(joblib.load(model_path))
+    encoder = FeatureEncoder.load(encoders_path, reference_csv=reference_csv)
+    return engine, encoder, forest_version(engine)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    model_path = argv[0] if len(argv) > 0 else MODEL_PATH
+    encoders_path = argv[1] if len(argv) > 1 else ENCODERS_PATH
+    output_path = argv[2] if len(argv) > 2 else ARTIFACT_PATH
+
+    engine, encoder, _ = load_model(None, model_path, encoders_path, REFERENCE_CSV)
+    manifest = save_artifact(output_path, engine, encoder)
+    print(f"Wrote {output_path} (model version {manifest['model_version']}, "
+          f"{manifest['n_trees']} trees, {manifest['n_nodes']} nodes)")
+
+
+if __name__ == '__main__':
+    main()
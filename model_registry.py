@@ -0,0 +1,176 @@
+"""
+Registry of per-district models, loaded lazily and evicted under a memory budget.
+
+Models are model artifacts named ``<model_id>.spm`` in one directory (see
+model_artifact.py). A model is loaded the first time a request asks for it
+and stays resident until the forests held exceed the memory budget, at which
+point the least recently used models are dropped. An evicted model is freed
+once the requests still using it have finished, and is loaded again on its
+next use.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from model_artifact import load_artifact
+from model_reloader import ServingModel
+
+_MODEL_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class UnknownModel(KeyError):
+    """No model with the requested ID exists"""
+
+    def __str__(self):
+        return f"Unknown model '{self.args[0]}'"
+
+
+class ModelLoadError(RuntimeError):
+    """A model exists but its artifact could not be loaded"""
+
+    def __str__(self):
+        return f"Model '{self.args[0]}' could not be loaded: {self.args[1]}"
+
+
+def artifact_loader(model_dir):
+    """Loader of ``<model_dir>/<model_id>.spm`` returning (engine, encoder, version)"""
+
+    def load(model_id):
+        path = os.path.join(model_dir, model_id + '.spm')
+        if not os.path.exists(path):
+            raise UnknownModel(model_id)
+        engine, encoder, manifest = load_artifact(path)
+        return engine, encoder, manifest['model_version']
+
+    return load
+
+
+class _Entry:
+    __slots__ = ('model', 'nbytes', 'last_used')
+
+    def __init__(self, model):
+        self.model = model
+        # The forest and its lookup tables, which the model has been warmed to build
+        self.nbytes = model.engine.nbytes + model.engine.cache_nbytes
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """Thread-safe LRU of ServingModels keyed by model ID.
+
+    ``loader(model_id)`` returns ``(engine, encoder, version)`` or raises
+    UnknownModel; any other loader failure is raised as ModelLoadError.
+    Models are warmed on load and evicted, least recently used first, while
+    their forests and lookup tables together exceed ``memory_budget`` bytes;
+    the model just requested is never evicted. With a ``metrics`` registry,
+    load and eviction counters and a per-model inference latency histogram
+    are kept.
+    """
+
+    def __init__(self, loader, memory_budget, metrics=None):
+        self.loader = loader
+        self.memory_budget = int(memory_budget)
+        self.metrics = metrics
+        self.loads = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._latency = {}
+
+    @staticmethod
+    def valid_id(model_id):
+        return bool(_MODEL_ID.match(model_id))
+
+    def get(self, model_id):
+        """The ServingModel for ``model_id``, loading it on first use"""
+        if not self.valid_id(model_id):
+            raise UnknownModel(model_id)
+        model = self._lookup(model_id)
+        if model is not None:
+            return model
+        # Loads are serialized so concurrent first requests load a model once
+        with self._load_lock:
+            model = self._lookup(model_id)
+            if model is not None:
+                return model
+            try:
+                model = ServingModel(*self.loader(model_id), model_id=model_id)
+            except UnknownModel:
+                raise
+            except Exception as e:
+                raise ModelLoadError(model_id, e) from e
+            # Built now so that they count towards the budget from the start
+            model.engine.warm()
+            with self._lock:
+                self._entries[model_id] = _Entry(model)
+                self._nbytes += self._entries[model_id].nbytes
+                self.loads += 1
+                evicted = self._evict(keep=model_id)
+            if self.metrics is not None:
+                self._counter('model_loads_total', 'Models loaded into the registry',
+                              model_id).inc()
+                for evicted_id in evicted:
+                    self._counter('model_evictions_total', 'Models evicted from the registry',
+                                  evicted_id).inc()
+            return model
+
+    def _lookup(self, model_id):
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(model_id)
+            entry.last_used = time.time()
+            return entry.model
+
+    def _evict(self, keep):
+        evicted = []
+        while self._nbytes > self.memory_budget and len(self._entries) > 1:
+            model_id = next(iter(self._entries))
+            if model_id == keep:
+                break
+            self._nbytes -= self._entries.pop(model_id).nbytes
+            self.evictions += 1
+            evicted.append(model_id)
+        return evicted
+
+    def _counter(self, name, help_text, model_id):
+        return self.metrics.counter(name, help_text, model=model_id)
+
+    def observe_latency(self, model_id, seconds):
+        """Record the inference time of one call to a model"""
+        if self.metrics is None:
+            return
+        histogram = self._latency.get(model_id)
+        if histogram is None:
+            histogram = self._latency.setdefault(model_id, self.metrics.histogram(
+                'model_inference_seconds', 'Model inference time per call', model=model_id))
+        histogram.observe(seconds)
+
+    def resident(self):
+        """(model_id, version, nbytes) of each resident model, least recently used first"""
+        with self._lock:
+            return [(model_id, entry.model.version, entry.nbytes)
+                    for model_id, entry in self._entries.items()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_budget_bytes': self.memory_budget,
+                'resident_bytes': self._nbytes,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'models': {
+                    model_id: {
+                        'version': entry.model.version,
+                        'bytes': entry.nbytes,
+                        'last_used': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                   time.gmtime(entry.last_used))
+                    }
+                    for model_id, entry in self._entries.items()
+                }
+            }
@@ -0,0 +1,167 @@
+"""
+Zero-downtime model hot-reload.
+
+The served model is one immutable ``ServingModel`` bundle (engine, encoder,
+version). A reload loads and warms a candidate off the request path,
+benchmarks its single-row latency against the current model and, if it is
+not too slow, replaces the bundle with a single reference assignment.
+Requests read the bundle once and use it throughout, so none ever sees a
+half-loaded or mixed model.
+
+Reloads are triggered by ``ModelReloader.reload`` (the admin endpoint) or by
+a watcher thread that polls the model files' modification times.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class ServingModel:
+    """An immutable snapshot of everything needed to serve predictions"""
+
+    __slots__ = ('engine', 'encoder', 'version', 'model_id', 'loaded_at', 'latency_p50_ms')
+
+    def __init__(self, engine, encoder, version, latency_p50_ms=None, model_id='default'):
+        self.engine = engine
+        self.encoder = encoder
+        self.version = version
+        self.model_id = model_id
+        self.loaded_at = time.time()
+        self.latency_p50_ms = latency_p50_ms
+
+    def describe(self):
+        return {
+            'model_id': self.model_id,
+            'version': self.version,
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.loaded_at)),
+            'latency_p50_ms': self.latency_p50_ms
+        }
+
+
+def single_row_latency(engine, encoder, rounds=200):
+    """Median single-row latency in ms of an explained prediction, as served
+    by /predict, after a warm-up pass.
+
+    The warm-up also faults the memory-mapped arrays in and builds the
+    explanation tables, so the first request served by a freshly loaded
+    model does not pay for them.
+    """
+    row = encoder.encode({})
+    for _ in range(20):
+        engine.explain(row)
+    timings = np.empty(rounds)
+    for i in range(rounds):
+        started = time.perf_counter()
+        engine.explain(row)
+        timings[i] = time.perf_counter() - started
+    return float(np.median(timings)) * 1000.0
+
+
+class ModelReloader:
+    """Owns the current ServingModel and replaces it on reload.
+
+    ``loader`` returns ``(engine, encoder, version)``. A candidate whose
+    single-row p50 latency exceeds ``max_slowdown`` times the current one
+    is rejected unless the reload is forced. ``on_swap(new, old)`` runs
+    after every swap, e.g. to invalidate caches.
+    """
+
+    def __init__(self, loader, max_slowdown=1.5, on_swap=None, initial=None):
+        self.loader = loader
+        self.max_slowdown = float(max_slowdown)
+        self.on_swap = on_swap
+        self.current = initial if initial is not None else self._load()
+        self.history = []
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def _load(self):
+        engine, encoder, version = self.loader()
+        return ServingModel(engine, encoder, version,
+                            latency_p50_ms=single_row_latency(engine, encoder))
+
+    def reload(self, force=False):
+        """Load, warm and benchmark a new model, then swap it in.
+
+        Returns a report dict whose ``status`` is ``swapped``, ``unchanged``,
+        ``rejected`` or ``failed``. The current model keeps serving in every
+        case but ``swapped``.
+        """
+        with self._lock:
+            old = self.current
+            # Re-measure the current model too, so both numbers share the same load
+            current_p50 = single_row_latency(old.engine, old.encoder)
+            report = {'current_version': old.version, 'current_p50_ms': current_p50,
+                      'forced': bool(force), 'timestamp': time.time()}
+            try:
+                candidate = self._load()
+            except Exception as e:
+                report.update(status='failed', error=str(e))
+                return self._record(report)
+
+            report.update(candidate_version=candidate.version,
+                          candidate_p50_ms=candidate.latency_p50_ms)
+            limit = current_p50 * self.max_slowdown
+            if candidate.version == old.version and not force:
+                report['status'] = 'unchanged'
+            elif candidate.latency_p50_ms > limit and not force:
+                report.update(status='rejected',
+                              error=f'Candidate p50 {candidate.latency_p50_ms:.3f}ms exceeds '
+                                    f'{self.max_slowdown}x the current {current_p50:.3f}ms')
+            else:
+                self.current = candidate
+                if self.on_swap is not None:
+                    self.on_swap(candidate, old)
+                report['status'] = 'swapped'
+            return self._record(report)
+
+    def _record(self, report):
+        self.history = (self.history + [report])[-20:]
+        return report
+
+    def watch(self, paths, interval=5.0):
+        """Reload in a daemon thread whenever one of ``paths`` changes.
+
+        A change is acted on once the modification time has stayed the same
+        for a whole interval, so a file still being written is not loaded.
+        """
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(list(paths), interval),
+                                         name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def _watch(self, paths, interval):
+        seen = _mtimes(paths)
+        pending = None
+        while True:
+            time.sleep(interval)
+            mtimes = _mtimes(paths)
+            if mtimes == seen:
+                pending = None
+            elif mtimes == pending:
+                seen = mtimes
+                pending = None
+                self.reload()
+            else:
+                pending = mtimes
+
+    def stats(self):
+        return {
+            'current': self.current.describe(),
+            'max_slowdown': self.max_slowdown,
+            'watching': self._watcher is not None,
+            'last_reload': self.history[-1] if self.history else None
+        }
+
+
+def _mtimes(paths):
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
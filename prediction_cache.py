@@ -0,0 +1,80 @@
+"""
+Bounded LRU cache of predictions keyed on the encoded feature vector.
+
+Almost every feature has a small discrete domain, so identical students are
+common in real traffic. A hit skips the model entirely.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """Thread-safe LRU cache of ``(label, proba)`` results.
+
+    Keys include the version of the model that made the prediction, so the
+    default model and every per-district model share one cache without ever
+    serving each other's predictions, and a key built before a reload never
+    matches an entry of the new model.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = int(capacity)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(row, model_version):
+        """Canonical key of an encoded feature row scored by ``model_version``.
+
+        The model compares features as float32, so rows that are equal in
+        float32 always get the same prediction and share one entry.
+        """
+        row = np.asarray(row, dtype=np.float32).ravel() + np.float32(0.0)  # -0.0 -> 0.0
+        return model_version, row.tobytes()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, model_version=None):
+        """Drop the entries of ``model_version`` (all by default), e.g. once it is replaced"""
+        with self._lock:
+            if model_version is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == model_version]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'capacity': self.capacity,
+                'size': len(self._entries),
+                'model_versions': dict(Counter(version for version, _ in self._entries)),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
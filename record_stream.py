@@ -0,0 +1,146 @@
+"""
+Incremental readers for bulk student uploads.
+
+Rosters arrive as NDJSON (one JSON object per line) or as CSV in the same
+column layout as student_data.csv. Both are read line by line so memory
+stays flat however large the upload is.
+"""
+import csv
+import io
+import json
+from itertools import chain, islice
+
+# Bytes read from an unbuffered upload stream at a time
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class InvalidRecord:
+    """Placeholder for an input line that could not be parsed"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def detect_format(content_type, requested=None):
+    """Pick 'csv' or 'ndjson' from an explicit format or the Content-Type"""
+    fmt = (requested or '').lower()
+    if not fmt:
+        fmt = 'csv' if 'csv' in (content_type or '').lower() else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError(f"Unsupported format '{fmt}': expected 'csv' or 'ndjson'")
+    return fmt
+
+
+def iter_lines(stream, encoding='utf-8'):
+    """Decode a binary stream into text lines without reading it all"""
+    if isinstance(stream, io.RawIOBase):
+        # Unbuffered streams, like werkzeug's request stream, would otherwise
+        # be read one byte at a time while looking for line ends
+        return io.TextIOWrapper(io.BufferedReader(stream, buffer_size=STREAM_BUFFER_SIZE),
+                                encoding=encoding, newline='\n')
+    return (line.decode(encoding) if isinstance(line, bytes) else line for line in stream)
+
+
+def iter_records(lines, fmt):
+    """Yield one dict per input row, or an InvalidRecord for unparsable lines"""
+    if fmt == 'csv':
+        # The header row names the columns, exactly like student_data.csv
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield _parse_line(line)
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return InvalidRecord(f'Invalid JSON: {e}')
+
+
+def iter_column_chunks(lines, fmt, size, columns):
+    """Yield ``(values, n_rows, errors)`` for every ``size`` input rows.
+
+    ``values`` maps each of ``columns`` present in the input to a sequence
+    of its raw values, one per row; ``errors`` maps chunk positions of
+    unparsable rows to messages. Going column by column lets the caller
+    encode a chunk with vectorized operations.
+    """
+    if fmt == 'csv':
+        yield from _csv_column_chunks(lines, size, columns)
+        return
+
+    lines = (line.strip() for line in lines)
+    for chunk in iter_chunks(filter(None, lines), size):
+        chunk = _parse_lines(chunk)
+        errors = {}
+        for i, record in enumerate(chunk):
+            if isinstance(record, InvalidRecord):
+                errors[i] = record.message
+            elif not isinstance(record, dict):
+                errors[i] = 'Record must be a JSON object'
+        if errors:
+            chunk = [{} if i in errors else record for i, record in enumerate(chunk)]
+        values = {col: [record.get(col) for record in chunk] for col in columns}
+        yield values, len(chunk), errors
+
+
+def _parse_lines(lines):
+    """Records of non-blank NDJSON lines, decoded in one call where possible"""
+    try:
+        # One decode for the whole chunk instead of one per line. JSON strings
+        # cannot hold a raw newline, so lines can only run together through
+        # unclosed brackets, which leaves fewer records than lines
+        records = json.loads('[' + ',\n'.join(lines) + ']')
+        if len(records) == len(lines):
+            return records
+    except ValueError:
+        pass
+    # Some line is malformed: parse line by line to report it on its own
+    return [_parse_line(line) for line in lines]
+
+
+def _csv_column_chunks(lines, size, columns):
+    lines = iter(lines)
+    header = next(csv.reader(lines), None)
+    if header is None:
+        return
+    wanted = [(col, header.index(col)) for col in columns if col in header]
+    width = len(header)
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        if any('"' in line for line in chunk):
+            # Quoted fields may hold commas or span lines: parse properly,
+            # reading on into later lines if a record continues there
+            chunk = list(islice(csv.reader(chain(chunk, lines)), len(chunk)))
+        else:
+            # Plain fields, by far the common case, split much faster
+            chunk = [line for line in (line.rstrip('\r\n') for line in chunk) if line]
+            if chunk and all(line.count(',') == width - 1 for line in chunk):
+                # Every row complete: split the chunk at once and slice out
+                # the columns, without building a list per row
+                fields = ','.join(chunk).split(',')
+                yield {col: fields[index::width] for col, index in wanted}, len(chunk), {}
+                continue
+            chunk = [line.split(',') for line in chunk]
+        # Short rows read as missing values and blank lines are skipped, as
+        # with csv.DictReader
+        chunk = [row if len(row) >= width else row + [None] * (width - len(row))
+                 for row in chunk if row]
+        if chunk:
+            fields = list(zip(*chunk))
+            yield {col: fields[index] for col, index in wanted}, len(chunk), {}
+
+
+def iter_chunks(records, size):
+    """Group an iterable into lists of at most ``size`` items"""
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
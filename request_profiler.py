@@ -0,0 +1,126 @@
+"""
+Per-request profiling for /predict.
+
+A trusted client can ask for a profile with the ``X-Profile`` header or the
+``profile`` query flag:
+
+    1 / true / timings   wall-clock time of each request stage
+    cprofile             stage timings plus a summarized cProfile
+
+A sampling rate also profiles a small fraction of ordinary requests and
+appends the reports to a local rotating log file. cProfile can only run one
+profile at a time per process, so a sample is skipped while another profile
+is active and a requested ``cprofile`` is refused.
+"""
+import cProfile
+import json
+import logging
+import pstats
+import random
+import threading
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+TIMINGS = 'timings'
+CPROFILE = 'cprofile'
+
+_MODES = {'1': TIMINGS, 'true': TIMINGS, 'yes': TIMINGS, TIMINGS: TIMINGS, CPROFILE: CPROFILE}
+
+
+def parse_mode(value):
+    """Profiling mode requested by a header or query value, or None"""
+    if not value:
+        return None
+    mode = _MODES.get(value.strip().lower())
+    if mode is None:
+        raise ValueError(f"Unknown profile mode '{value}': expected 1, timings or cprofile")
+    return mode
+
+
+class ProfilerBusy(RuntimeError):
+    """Another request is already being profiled with cProfile"""
+
+
+class Capture:
+    """Holds the summarized cProfile of one captured call"""
+
+    def __init__(self):
+        self.summary = None
+        self.skipped = False
+
+
+def summarize(profiler, limit=15):
+    """Top functions of a cProfile run by cumulative time"""
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'total_ms': total * 1000.0,
+            'cumulative_ms': cumulative * 1000.0
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+class RequestProfiler:
+    """Decides which requests are profiled and records sampled reports"""
+
+    def __init__(self, trusted_clients=(), sample_rate=0.0,
+                 log_path='profiles.log', max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.trusted_clients = set(trusted_clients)
+        self.sample_rate = float(sample_rate)
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._logger = None
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+
+    def is_trusted(self, remote_addr):
+        return remote_addr in self.trusted_clients
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def capture(self, enabled, required=False):
+        """Run the block under cProfile when ``enabled``.
+
+        Only one profile runs at a time. While another is active the block
+        runs unprofiled with ``skipped`` set, or, when ``required``,
+        ProfilerBusy is raised before it runs.
+        """
+        capture = Capture()
+        if not enabled:
+            yield capture
+            return
+        if not self._profile_lock.acquire(blocking=False):
+            if required:
+                raise ProfilerBusy('Another request is being profiled; retry shortly')
+            capture.skipped = True
+            yield capture
+            return
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield capture
+            finally:
+                profiler.disable()
+                capture.summary = summarize(profiler)
+        finally:
+            self._profile_lock.release()
+
+    def log(self, report):
+        """Append a sampled report to the rotating profile log"""
+        with self._lock:
+            if self._logger is None:
+                logger = logging.getLogger('spp.profiles')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.addHandler(RotatingFileHandler(self.log_path, maxBytes=self.max_bytes,
+                                                      backupCount=self.backup_count))
+                self._logger = logger
+        self._logger.info(json.dumps(report))
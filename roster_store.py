@@ -0,0 +1,385 @@
+"""
+Persistent rosters with materialized scores.
+
+Each roster is a directory holding its encoded students column by column,
+their predicted probabilities and the model version that produced each
+score:
+
+    manifest.json          rows, columns, encoder, model versions
+    features/<column>.f32  one float32 value per student
+    proba.f64              (rows, classes) probabilities
+    version.u16            per student, an index into the manifest's versions
+
+The files are memory-mapped, so reading scores never touches the model.
+Updating a student re-scores that student only if an encoded value changed,
+and a model swap re-scores every roster in the background, skipping
+students already scored by the new model.
+
+Several worker processes may serve the same rosters. The memory maps are
+shared, and every change to a roster holds an exclusive lock on its
+``manifest.lock`` file and re-reads the manifest first, so the version
+index and encoder stay the same in every process.
+"""
+import fcntl
+import json
+import os
+import secrets
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from feature_encoder import FeatureEncoder
+
+FORMAT_VERSION = 1
+
+# Students re-scored per model call by a bulk re-score
+RESCORE_CHUNK_SIZE = 10000
+
+
+class RosterNotFound(KeyError):
+    pass
+
+
+class Roster:
+    """One persisted roster; every method is safe to call from many threads and processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._manifest_stat = None
+        self._load_manifest()
+        self._map()
+
+    @classmethod
+    def create(cls, path, model, chunks, name=None):
+        """Write a roster from ``(encoded rows,)`` chunks, scoring each with ``model``"""
+        os.makedirs(os.path.join(path, 'features'))
+        columns = list(model.encoder.columns)
+        n_rows = 0
+        files = [open(os.path.join(path, 'features', f'{col}.f32'), 'wb') for col in columns]
+        try:
+            with open(os.path.join(path, 'proba.f64'), 'wb') as proba_file:
+                for matrix in chunks:
+                    # Scored as stored, so a re-score of an unchanged row agrees
+                    matrix = matrix.astype('<f4')
+                    for i, f in enumerate(files):
+                        f.write(matrix[:, i].tobytes())
+                    proba_file.write(model.engine.predict_proba(matrix).astype('<f8').tobytes())
+                    n_rows += len(matrix)
+        finally:
+            for f in files:
+                f.close()
+        np.zeros(n_rows, dtype='<u2').tofile(os.path.join(path, 'version.u16'))
+
+        now = _timestamp()
+        _write_manifest(path, {
+            'format_version': FORMAT_VERSION,
+            'roster_id': os.path.basename(path),
+            'name': name,
+            'created': now,
+            'updated': now,
+            'n_rows': n_rows,
+            'columns': columns,
+            'classes': model.engine.classes.tolist(),
+            'encoder': model.encoder.to_dict(),
+            'versions': [model.version]
+        })
+        return cls(path)
+
+    def _load_manifest(self, force=False):
+        """Read the manifest, unless it has not been replaced since the last read"""
+        manifest_path = os.path.join(self.path, 'manifest.json')
+        stat = os.stat(manifest_path)
+        # Every write replaces the file, so a new inode or mtime means a new manifest
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if not force and key == self._manifest_stat:
+            return
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if self._manifest_stat is None or manifest['encoder'] != self.manifest['encoder']:
+            self.encoder = FeatureEncoder.from_dict(manifest['encoder'])
+        self.manifest = manifest
+        self._manifest_stat = key
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the roster against other threads and processes, with the manifest re-read"""
+        with self.lock, open(os.path.join(self.path, 'manifest.lock'), 'a') as lock_file:
+            # Released when the file is closed
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load_manifest(force=True)
+            yield
+
+    def _map(self):
+        n_rows = self.manifest['n_rows']
+        n_classes = len(self.manifest['classes'])
+        if not n_rows:
+            # Empty files cannot be memory-mapped
+            self.features = {col: np.zeros(0, dtype='<f4') for col in self.manifest['columns']}
+            self.proba = np.zeros((0, n_classes))
+            self.version = np.zeros(0, dtype='<u2')
+            return
+        self.features = {col: np.memmap(os.path.join(self.path, 'features', f'{col}.f32'),
+                                        dtype='<f4', mode='r+', shape=(n_rows,))
+                         for col in self.manifest['columns']}
+        self.proba = np.memmap(os.path.join(self.path, 'proba.f64'), dtype='<f8', mode='r+',
+                               shape=(n_rows, n_classes))
+        self.version = np.memmap(os.path.join(self.path, 'version.u16'), dtype='<u2',
+                                 mode='r+', shape=(n_rows,))
+
+    @property
+    def roster_id(self):
+        return self.manifest['roster_id']
+
+    @property
+    def n_rows(self):
+        return self.manifest['n_rows']
+
+    def _rows(self, start, stop):
+        """Encoded students ``start:stop`` as a (rows, features) matrix"""
+        return np.column_stack([self.features[col][start:stop] for col in self.encoder.columns])
+
+    def _version_index(self, version):
+        """Index of ``version`` in the manifest, adding it if new; call under ``_exclusive``"""
+        versions = self.manifest['versions']
+        if version not in versions:
+            versions.append(version)
+            # Written before any student refers to it, so readers can resolve it
+            self._write()
+        return versions.index(version)
+
+    def scores(self, offset=0, limit=100):
+        """Stored predictions of students ``offset:offset + limit``"""
+        self._load_manifest()
+        stop = min(offset + limit, self.n_rows)
+        classes = self.manifest['classes']
+        versions = self.manifest['versions']
+        proba = np.array(self.proba[offset:stop])
+        version = np.array(self.version[offset:stop])
+        results = []
+        for i, (p, v) in enumerate(zip(proba, version)):
+            prediction = int(classes[int(p.argmax())])
+            results.append({
+                'row': offset + i,
+                'prediction': prediction,
+                'prediction_text': 'Pass' if prediction == 1 else 'Fail',
+                'probability': {'fail': float(p[0]), 'pass': float(p[1])},
+                'model_version': versions[v]
+            })
+        return results
+
+    def student(self, row):
+        """The stored student ``row`` and its score"""
+        self._check_row(row)
+        self._load_manifest()
+        record = self.encoder.decode(self._rows(row, row + 1)[0])
+        return dict(self.scores(row, 1)[0], student=record)
+
+    def _check_row(self, row):
+        if not 0 <= row < self.n_rows:
+            raise IndexError(f'Row {row} is not in roster {self.roster_id}')
+
+    def update(self, model, row, delta):
+        """Apply changed fields to one student; returns (changed features, re-scored)"""
+        if not isinstance(delta, dict):
+            raise ValueError('Record must be a JSON object')
+        self._check_row(row)
+        with self._exclusive():
+            self._adopt_encoder(model.encoder)
+            old = self._rows(row, row + 1)[0].astype(np.float32)
+            new = model.encoder.encode(dict(self.encoder.decode(old), **delta)).astype(np.float32)
+            changed = [col for col, a, b in zip(self.encoder.columns, old, new) if a != b]
+            stale = self.manifest['versions'][self.version[row]] != model.version
+            if not changed and not stale:
+                return changed, False
+            for col, value in zip(self.encoder.columns, new):
+                self.features[col][row] = value
+            self.proba[row] = model.engine.predict_proba(new)[0]
+            self.version[row] = self._version_index(model.version)
+            self._commit()
+            return changed, True
+
+    def rescore(self, model, chunk_size=RESCORE_CHUNK_SIZE, superseded=None):
+        """Re-score every student not yet scored by ``model``; returns the number re-scored.
+
+        Stops between chunks once ``superseded()`` is true.
+        """
+        rescored = 0
+        for start in range(0, self.n_rows, chunk_size):
+            if superseded is not None and superseded():
+                break
+            # The lock is released between chunks so updates are not held up
+            with self._exclusive():
+                self._adopt_encoder(model.encoder)
+                target = self._version_index(model.version)
+                stop = min(start + chunk_size, self.n_rows)
+                stale = np.flatnonzero(self.version[start:stop] != target)
+                if len(stale):
+                    self.proba[start + stale] = model.engine.predict_proba(
+                        self._rows(start, stop)[stale])
+                    self.version[start + stale] = target
+                    self._commit()
+                rescored += len(stale)
+        return rescored
+
+    def _adopt_encoder(self, encoder):
+        """Re-code categorical columns if ``encoder`` numbers categories differently"""
+        if encoder.to_dict() == self.encoder.to_dict():
+            return
+        if list(encoder.columns) != list(self.encoder.columns):
+            raise ValueError(f'Roster {self.roster_id} was stored with different features')
+        for col, classes in self.encoder.classes.items():
+            lookup = encoder.lookup[col]
+            codes = np.array([lookup.get(value, encoder.fallback_codes[col]) for value in classes],
+                             dtype=np.float32)
+            values = self.features[col]
+            values[:] = codes[values.astype(np.intp)]
+        self.encoder = encoder
+        self.manifest['encoder'] = encoder.to_dict()
+        # Other processes must decode the recoded values with the new encoder
+        self._commit()
+
+    def _commit(self):
+        for array in (self.proba, self.version, *self.features.values()):
+            if isinstance(array, np.memmap):
+                array.flush()
+        self.manifest['updated'] = _timestamp()
+        self._write()
+
+    def _write(self):
+        _write_manifest(self.path, self.manifest)
+        stat = os.stat(os.path.join(self.path, 'manifest.json'))
+        self._manifest_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def describe(self):
+        self._load_manifest()
+        versions = self.manifest['versions']
+        counts = np.bincount(self.version, minlength=len(versions))
+        return {
+            'roster_id': self.roster_id,
+            'name': self.manifest['name'],
+            'created': self.manifest['created'],
+            'updated': self.manifest['updated'],
+            'n_rows': self.n_rows,
+            'model_versions': {versions[i]: int(n) for i, n in enumerate(counts) if n}
+        }
+
+
+class RosterStore:
+    """Every roster under ``root``, loaded on first use"""
+
+    def __init__(self, root):
+        self.root = root
+        self._rosters = {}
+        self._lock = threading.Lock()
+        self._rescoring = None
+        # The model the re-score worker should apply next, and the worker
+        self._pending = None
+        self._worker = None
+        os.makedirs(root, exist_ok=True)
+
+    def ids(self):
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, 'manifest.json')))
+
+    def get(self, roster_id):
+        with self._lock:
+            roster = self._rosters.get(roster_id)
+            if roster is not None and not os.path.exists(os.path.join(roster.path, 'manifest.json')):
+                # Deleted by another process
+                del self._rosters[roster_id]
+                roster = None
+            if roster is None:
+                if roster_id not in self.ids():
+                    raise RosterNotFound(f"Unknown roster '{roster_id}'")
+                roster = self._rosters[roster_id] = Roster(os.path.join(self.root, roster_id))
+            return roster
+
+    def create(self, model, chunks, name=None):
+        """Store a roster from chunks of encoded rows; a failed upload leaves nothing behind"""
+        roster_id = secrets.token_hex(8)
+        path = os.path.join(self.root, roster_id)
+        try:
+            roster = Roster.create(path, model, chunks, name=name)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        with self._lock:
+            self._rosters[roster_id] = roster
+        return roster
+
+    def delete(self, roster_id):
+        roster = self.get(roster_id)
+        with roster._exclusive(), self._lock:
+            self._rosters.pop(roster_id, None)
+            shutil.rmtree(roster.path)
+
+    def rescore_all(self, model):
+        """Re-score every roster with ``model`` on the background re-score worker.
+
+        There is one worker per store. A model waiting its turn is replaced
+        by a newer one, and a re-score in progress stops between chunks when
+        a newer model arrives, so only the latest model is ever applied.
+        """
+        with self._lock:
+            self._pending = model
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._rescore_worker,
+                                                name='roster-rescore', daemon=True)
+                self._worker.start()
+            return self._worker
+
+    def _rescore_worker(self):
+        while True:
+            with self._lock:
+                model, self._pending = self._pending, None
+                if model is None:
+                    self._worker = None
+                    return
+            self._rescore_all(model)
+
+    def _superseded(self):
+        return self._pending is not None
+
+    def _rescore_all(self, model):
+        started = time.time()
+        progress = {'model_version': model.version, 'rosters_done': 0, 'rows_rescored': 0}
+        self._rescoring = progress
+        for roster_id in self.ids():
+            if self._superseded():
+                break
+            try:
+                progress['rows_rescored'] += self.get(roster_id).rescore(
+                    model, superseded=self._superseded)
+            except (RosterNotFound, FileNotFoundError):
+                # Deleted while waiting its turn
+                continue
+            if self._superseded():
+                break
+            progress['rosters_done'] += 1
+        progress['seconds'] = time.time() - started
+        progress['superseded'] = self._superseded()
+        progress['done'] = True
+
+    def stats(self):
+        return {
+            'root': self.root,
+            'rosters': len(self.ids()),
+            'last_rescore': self._rescoring
+        }
+
+
+def _write_manifest(path, manifest):
+    # Write to a temporary file and rename, so readers never see a partial
+    # manifest; the name is unique so that writers never share a file
+    tmp_path = os.path.join(path, f'manifest.json.{os.getpid()}.{secrets.token_hex(4)}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(path, 'manifest.json'))
+
+
+def _timestamp():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
@@ -0,0 +1,135 @@
+"""
+Scoring sessions for interactive forms that change one field at a time.
+
+A session keeps a student's raw record together with the decision path
+taken in every tree, as at most ``max_depth`` int32 edge ids per tree (about
+4 KB for the shipped forest); leaves, tested features and contributions are
+read off the paths when needed. A delta of a few fields re-traces only the
+trees whose paths test one of the changed features; every other tree is
+known to reach the same leaf. Probabilities and contributions are identical
+to scoring the updated student from scratch.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ScoringSession:
+    """Per-tree state of one student's prediction.
+
+    ``model`` is the ServingModel the state belongs to. ``update`` re-traces
+    everything when given a different model, e.g. after a reload.
+    """
+
+    def __init__(self, model, record):
+        self.lock = threading.Lock()
+        self.record = {}
+        self.row = None
+        self.model = None
+        self.update(model, record)
+
+    def update(self, model, delta):
+        """Apply a partial record; returns (changed features, trees recomputed)"""
+        if not isinstance(delta, dict):
+            raise ValueError('Record must be a JSON object')
+        record = dict(self.record, **delta)
+        row = model.encoder.encode(record)
+        if self.model is None or model.version != self.model.version:
+            changed = list(model.encoder.columns)
+            self.edges = model.engine.trace(row)
+            trees = model.engine.n_trees
+        else:
+            # The engine compares features as float32
+            columns = np.flatnonzero(row.astype(np.float32) != self.row.astype(np.float32))
+            changed = [model.encoder.columns[i] for i in columns]
+            affected = np.flatnonzero(model.engine.path_tests(self.edges, columns))
+            if len(affected):
+                self.edges[affected] = model.engine.trace(row, affected)
+            trees = len(affected)
+        self.model = model
+        self.record = record
+        self.row = row
+        return changed, trees
+
+    def explain(self):
+        """(label, probabilities, contributions) of the current student, as ``engine.explain``"""
+        engine = self.model.engine
+        # Sum trees in estimator order, then average, as predict_proba does
+        proba = engine.value.take(engine.path_leaves(self.edges), axis=0).sum(axis=0)
+        proba /= engine.n_trees
+        return engine.classes[proba.argmax()], proba, engine.path_contributions(self.edges)
+
+
+class SessionStore:
+    """Thread-safe LRU of ScoringSessions keyed by a random session ID.
+
+    Sessions idle for more than ``ttl`` seconds expire; beyond ``capacity``
+    sessions the least recently used is dropped.
+    """
+
+    def __init__(self, capacity=2000, ttl=1800.0):
+        self.capacity = int(capacity)
+        self.ttl = float(ttl)
+        self.created = 0
+        self.expired = 0
+        self.updates = 0
+        self.trees_recomputed = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session):
+        session_id = secrets.token_hex(16)
+        with self._lock:
+            self._expire()
+            self._sessions[session_id] = (session, time.monotonic())
+            self.created += 1
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+                self.expired += 1
+        return session_id
+
+    def get(self, session_id):
+        """The session, or None if it does not exist or has expired"""
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], time.monotonic())
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def record_update(self, trees):
+        """Count one delta and the trees it re-traced"""
+        with self._lock:
+            self.updates += 1
+            self.trees_recomputed += trees
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if last_used >= cutoff:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'ttl_seconds': self.ttl,
+                'active': len(self._sessions),
+                'created': self.created,
+                'expired': self.expired,
+                'updates': self.updates,
+                'trees_recomputed': self.trees_recomputed,
+                'avg_trees_recomputed': self.trees_recomputed / self.updates if self.updates else 0.0
+            }
@@ -1,25 +1,20 @@
 # Prepare data for machine learning
-from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import joblib
 
-# Create a copy for processing
-data_processed = student_data.copy()
+from feature_encoder import FeatureEncoder
+from forest_engine import FlatForest
+from model_artifact import save_artifact
 
-# Encode categorical variables
-categorical_columns = ['sex', 'address', 'famsize', 'Pstatus', 'schoolsup', 'famsup', 'paid', 'activities', 'internet', 'romantic']
-
-label_encoders = {}
-for col in categorical_columns:
-    le = LabelEncoder()
-    data_processed[col] = le.fit_transform(data_processed[col])
-    label_encoders[col] = le
+# Encode categorical variables with the same encoder the API uses
+feature_encoder = FeatureEncoder.fit(student_data)
+label_encoders = feature_encoder.label_encoders
 
 # Prepare features and target
-X = data_processed.drop('final_grade', axis=1)
-y = data_processed['final_grade']
+X = pd.DataFrame(feature_encoder.transform(student_data), columns=feature_encoder.columns)
+y = student_data['final_grade']
 
 # Split the data
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
@@ -65,6 +60,10 @@ print("\nSaving model and encoders...")
 joblib.dump(rf_model, 'student_performance_model.pkl')
 joblib.dump(label_encoders, 'label_encoders.pkl')
 
+# Export the memory-mappable artifact the API loads at startup
+save_artifact('student_performance_model.spm', FlatForest.from_sklearn(rf_model), feature_encoder,
+              metadata={'accuracy': float(accuracy)})
+
 # Save sample data for testing
 student_data.to_csv('student_data.csv', index=False)
 
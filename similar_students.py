@@ -0,0 +1,195 @@
+"""
+Similar students by random-forest proximity, served from a leaf index.
+
+The proximity of two students is the number of trees in which they reach the
+same leaf. The index stores each reference row's leaf in every tree, plus an
+inverted index from leaf tuples to rows: the trees are split into bands, and
+for every band the rows are sorted by a hash of the leaves they reach in it.
+
+A row that reaches a different leaf from the query in fewer trees than there
+are bands reaches the same leaves in at least one whole band, so it is in
+one of the query's buckets. Scoring the rows of those buckets exactly
+therefore finds every row sharing more than ``n_trees - n_bands`` leaves. A
+query tries wide bands (few, small buckets) first, then narrow bands, and
+the answer is exact once a level finds ``k`` rows above its bound.
+
+No query scores more than ``max_candidates`` rows. When the buckets hold
+more, the rows matching the query in the most bands are scored; when no
+level proves the answer exact, the best rows scored are returned and
+flagged as approximate rather than scanning every row. Neighbours get
+closer as the reference set grows, so large sets are almost always
+answered exactly from the buckets; sets no larger than the cap are simply
+scanned.
+"""
+import csv
+import time
+
+import numpy as np
+
+# Trees per band of each index level, tried in order
+BAND_WIDTHS = (10, 4)
+
+# Most reference rows one query compares with the student
+MAX_CANDIDATES = 20000
+
+
+class ProximityIndex:
+    """Leaf index of ``X`` under ``engine`` for top-k proximity queries"""
+
+    def __init__(self, engine, X, band_widths=BAND_WIDTHS, seed=0):
+        self.engine = engine
+        leaves = engine.apply(X)
+        self.n_rows = leaves.shape[0]
+
+        # Leaves are stored as their ordinal among the leaves of their tree
+        is_leaf = engine.left == np.arange(engine.n_nodes)
+        ordinal = np.cumsum(is_leaf) - 1
+        first = ordinal[engine.roots]
+        dtype = np.uint8 if (ordinal[np.append(engine.roots[1:], engine.n_nodes) - 1]
+                             - first).max() <= np.iinfo(np.uint8).max else np.uint16
+        self._leaf_ordinal = ordinal
+        self._first_ordinal = first
+        self._row_leaves = np.ascontiguousarray((ordinal[leaves] - first).astype(dtype))
+        self._count_dtype = np.uint8 if engine.n_trees <= np.iinfo(np.uint8).max else np.uint16
+
+        # One odd multiplier per tree; the high half of the multiply-sum
+        # over a band is the band's bucket key
+        rng = np.random.default_rng(seed)
+        self._multipliers = rng.integers(1, 2 ** 63, size=engine.n_trees,
+                                         dtype=np.uint64) | np.uint64(1)
+        # Per level: the first tree of every band, and each band's sorted
+        # keys with the rows they belong to
+        self._levels = []
+        for width in band_widths:
+            bands = np.array_split(np.arange(engine.n_trees), max(1, engine.n_trees // width))
+            buckets = []
+            for band in bands:
+                keys = self._band_keys(self._row_leaves[:, band], self._multipliers[band])
+                order = np.argsort(keys, kind='stable').astype(np.int32)
+                buckets.append((keys[order], order))
+            self._levels.append((np.array([band[0] for band in bands]), buckets))
+
+    @property
+    def nbytes(self):
+        return self._row_leaves.nbytes + sum(keys.nbytes + rows.nbytes
+                                             for _, buckets in self._levels
+                                             for keys, rows in buckets)
+
+    @staticmethod
+    def _band_keys(row_leaves, multipliers):
+        hashed = (row_leaves.astype(np.uint64) * multipliers).sum(axis=1)
+        return (hashed >> np.uint64(32)).astype(np.uint32)
+
+    def _shared(self, rows, query):
+        """Leaves each of ``rows`` (every row if None) shares with the query"""
+        row_leaves = self._row_leaves if rows is None else self._row_leaves[rows]
+        return ((row_leaves == query).view(np.uint8)
+                .sum(axis=1, dtype=self._count_dtype).astype(np.intp))
+
+    def query(self, x, k=10, max_candidates=MAX_CANDIDATES):
+        """Return ``(rows, shared, rows_scored, exact)`` for the ``k`` rows sharing the most leaves with ``x``.
+
+        Ties go to the earlier row. ``rows_scored`` is the number of rows
+        compared with the query, at most ``max_candidates`` unless every
+        row is. When ``exact`` is False the rows are the best of those
+        scored, and fewer than ``k`` may be returned.
+        """
+        leaves = self.engine.apply(x)[0]
+        query = (self._leaf_ordinal[leaves] - self._first_ordinal).astype(self._row_leaves.dtype)
+        k = min(k, self.n_rows)
+        if self.n_rows <= max_candidates:
+            shared = self._shared(None, query)
+            return _top(np.arange(self.n_rows), shared, k) + (self.n_rows, True)
+
+        rows = np.empty(0, dtype=np.int32)
+        shared = np.empty(0, dtype=np.intp)
+        hashed = query.astype(np.uint64) * self._multipliers
+        for starts, buckets in self._levels:
+            query_keys = (np.add.reduceat(hashed, starts) >> np.uint64(32)).astype(np.uint32)
+            candidates, bands = np.unique(np.concatenate([
+                bucket_rows[keys.searchsorted(key):keys.searchsorted(key, 'right')]
+                for key, (keys, bucket_rows) in zip(query_keys, buckets)
+            ]), return_counts=True)
+            new = ~np.isin(candidates, rows, assume_unique=True)
+            candidates, bands = candidates[new], bands[new]
+            budget = max_candidates - len(rows)
+            complete = len(candidates) <= budget
+            if not complete:
+                # Rows matching the query in more bands tend to share more leaves
+                candidates = np.sort(candidates[np.argsort(-bands, kind='stable')[:budget]])
+            rows = np.concatenate([rows, candidates])
+            shared = np.concatenate([shared, self._shared(candidates, query)])
+            # Rows outside the buckets share at most n_trees - n_bands leaves;
+            # strictly more keeps ties going to the earlier row
+            if complete and len(shared) >= k \
+                    and np.partition(shared, -k)[-k] > self.engine.n_trees - len(starts):
+                return _top(rows, shared, k) + (len(rows), True)
+            if len(rows) >= max_candidates:
+                break
+        return _top(rows, shared, min(k, len(rows))) + (len(rows), False)
+
+
+def _top(rows, shared, k):
+    """The ``k`` rows with the most shared leaves, ties going to the earlier row"""
+    if len(shared) > k:
+        keep = np.flatnonzero(shared >= np.partition(shared, -k)[-k])
+        rows, shared = rows[keep], shared[keep]
+    order = np.lexsort((rows, -shared))[:k]
+    return rows[order], shared[order]
+
+
+class ReferenceSet:
+    """The reference students of one model and their proximity index.
+
+    Queries are encoded and traced with the model the index was built for,
+    so a reference set stays consistent while a newer one is being built.
+    """
+
+    def __init__(self, model, path):
+        started = time.perf_counter()
+        self.model = model
+        self.path = path
+        self.rows, self.records, matrix = load_reference(path, model.encoder)
+        self.index = ProximityIndex(model.engine, matrix)
+        self.build_seconds = time.perf_counter() - started
+
+    def similar(self, student, k):
+        """The ``k`` reference students closest to ``student``, the rows scored and whether exact"""
+        rows, shared, scored, exact = self.index.query(self.model.encoder.encode(student), k)
+        n_trees = self.model.engine.n_trees
+        return [{
+            'row': self.rows[i],
+            'shared_leaves': int(s),
+            'proximity': float(s) / n_trees,
+            'student': self.records[i]
+        } for i, s in zip(rows, shared)], scored, exact
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'model_version': self.model.version,
+            'reference_rows': self.index.n_rows,
+            'index_bytes': self.index.nbytes,
+            'build_seconds': self.build_seconds
+        }
+
+
+def load_reference(path, encoder):
+    """Row numbers, raw records and encoded matrix of a reference CSV.
+
+    Numbers are parsed so records serialize like the original data; rows
+    that cannot be encoded are skipped, so row numbers may have gaps.
+    """
+    with open(path, newline='') as f:
+        records = [{column: _parse(value) for column, value in row.items()}
+                   for row in csv.DictReader(f)]
+    matrix, positions, _ = encoder.encode_batch(records)
+    return positions, [records[i] for i in positions], matrix
+
+
+def _parse(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return int(number) if number.is_integer() else number
@@ -0,0 +1,92 @@
+"""
+Startup-time accounting for the API.
+
+Records how long the server takes to import its modules, load the model and
+serve its first prediction, and can print a report on demand:
+
+    python app.py --startup-report
+"""
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+class StartupProfile:
+    """Named startup timings, in seconds since the profile was created"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a startup phase, e.g. ``with profile.phase('load model'):``"""
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = time.perf_counter() - phase_start
+            self.mark(name)
+
+    def mark(self, name):
+        """Record the elapsed time at which ``name`` happened, the first time only"""
+        if name in self.marks:
+            return
+        with self._lock:
+            self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def as_dict(self):
+        return {
+            'phases_ms': {name: seconds * 1000.0 for name, seconds in self.durations.items()},
+            'elapsed_ms': {name: seconds * 1000.0 for name, seconds in self.marks.items()}
+        }
+
+
+def import_times(module, max_depth=1):
+    """Import ``module`` in a fresh interpreter and return its import times.
+
+    Returns ``(name, self_ms, cumulative_ms)`` tuples, slowest first, for the
+    module and the imports nested at most ``max_depth`` levels below it.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    # -X importtime prints nested imports before the module that triggered
+    # them, so the subtree of ``module`` is every line since the previous
+    # top-level entry
+    subtree = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = (len(indent) - 1) // 2
+        if depth <= max_depth:
+            subtree.append((name, int(self_us) / 1000.0, int(cumulative_us) / 1000.0))
+        if depth == 0:
+            if name == module:
+                return sorted(subtree, key=lambda entry: entry[2], reverse=True)
+            subtree = []
+    return []
+
+
+def format_report(profile, imports=None):
+    """Human-readable startup report"""
+    lines = ['Startup report', '==============']
+    if imports:
+        lines.append('Import time (cumulative / self, ms):')
+        for name, self_ms, cumulative_ms in imports:
+            lines.append(f'  {name:<32} {cumulative_ms:9.1f} {self_ms:9.1f}')
+    lines.append('Phases (ms):')
+    for name, seconds in profile.durations.items():
+        lines.append(f'  {name:<32} {seconds * 1000.0:9.2f}')
+    lines.append('Elapsed after imports (ms):')
+    for name, seconds in profile.marks.items():
+        lines.append(f'  {name:<32} {seconds * 1000.0:9.2f}')
+    return '\n'.join(lines)
@@ -0,0 +1,52 @@
+"""
+What-if sweeps: one student scored at every combination of chosen features.
+
+The values each feature can take come from the ranges served by
+``/feature_info``. The grid is built directly in encoded form, one row per
+combination, so it can be scored with a single model call.
+"""
+import math
+
+import numpy as np
+
+
+def feature_values(feature_info, feature):
+    """Every value ``feature`` can take: its categories or its integer range"""
+    if feature in feature_info['categorical_features']:
+        return list(feature_info['categorical_features'][feature])
+    spec = feature_info['numerical_features'].get(feature)
+    if spec is None:
+        raise ValueError(f"Unknown feature '{feature}'")
+    return list(range(spec['min'], spec['max'] + 1))
+
+
+def sweep_grid(encoder, row, features, feature_info, max_points):
+    """Encoded rows for ``row`` with ``features`` set to every combination of values.
+
+    Returns ``(values, shape, grid)``: the values of each feature, the grid
+    shape (one axis per feature, in order) and the ``(prod(shape),
+    n_features)`` matrix in C order, so the last feature varies fastest.
+    """
+    if not features:
+        raise ValueError('Expected at least one feature to vary')
+    if len(set(features)) != len(features):
+        raise ValueError('Each feature may only be varied once')
+    values = {feature: feature_values(feature_info, feature) for feature in features}
+    shape = tuple(len(values[feature]) for feature in features)
+    size = math.prod(shape)
+    if size > max_points:
+        raise ValueError(f'Grid too large: {size} points, at most {max_points}')
+
+    codes = []
+    for feature in features:
+        lookup = encoder.lookup.get(feature)
+        if lookup is None:
+            codes.append(np.asarray(values[feature], dtype=np.float64))
+        else:
+            fallback = encoder.fallback_codes[feature]
+            codes.append(np.asarray([lookup.get(value, fallback) for value in values[feature]]))
+
+    grid = np.repeat(np.asarray(row, dtype=np.float64)[np.newaxis, :], size, axis=0)
+    for feature, mesh in zip(features, np.meshgrid(*codes, indexing='ij')):
+        grid[:, encoder.columns.index(feature)] = mesh.ravel()
+    return values, shape, grid